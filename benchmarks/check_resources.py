@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+ResourceCache check.
+Drives the resource handlers the way CEF's IO thread does, through fake
+request, callback and response objects, against a local SimpleHTTPServer.
+Needs neither CEF nor Kivy:
+
+    python benchmarks/check_resources.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+from cefkivy.resources import FetchHandler, FileHandler, MemoryHandler, ResourceCache
+
+
+class Request(object):
+
+    def __init__(self, url, method="GET"):
+        self.url = url
+        self.method = method
+
+    def GetUrl(self):
+        return self.url
+
+    def GetMethod(self):
+        return self.method
+
+
+class Callback(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def Continue(self):
+        self.event.set()
+
+    def wait(self):
+        if not self.event.wait(5):
+            raise AssertionError("Callback not called")
+        self.event.clear()
+
+
+class Response(object):
+    status = None
+    status_text = None
+    mime_type = None
+
+    def SetStatus(self, status):
+        self.status = status
+
+    def SetStatusText(self, text):
+        self.status_text = text
+
+    def SetMimeType(self, mime_type):
+        self.mime_type = mime_type
+
+
+def load(handler, read_size=4096):
+    """
+    Runs the request through handler like CEF does, returns (response,
+    length, body).
+    """
+    callback = Callback()
+    assert handler.ProcessRequest(Request(handler.url), callback)
+    callback.wait()
+    response = Response()
+    length = [None]
+    handler.GetResponseHeaders(response, length, [None])
+    body = []
+    while True:
+        data, read = [None], [0]
+        if not handler.ReadResponse(data, read_size, read, callback):
+            break
+        if read[0] == 0:
+            # Asynchronous read, CEF waits for Continue()
+            callback.wait()
+            continue
+        body.append(data[0])
+    return response, length[0], b"".join(body)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    root = None
+
+    def translate_path(self, path):
+        # SimpleHTTPRequestHandler serves the current directory
+        path = SimpleHTTPRequestHandler.translate_path(self, path)
+        return os.path.join(self.root, os.path.relpath(path, os.getcwd()))
+
+    def log_message(self, *largs):
+        pass
+
+
+def start_server(directory):
+    handler = type("Handler", (QuietHandler, object), {"root": directory})
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    try:
+        pages = os.path.join(tmp, "pages")
+        static = os.path.join(tmp, "static")
+        for directory in (pages, pages+"-private", static):
+            os.mkdir(directory)
+        write(os.path.join(pages, "index.html"), b"<h1>Start</h1>")
+        write(os.path.join(pages, "two words.html"), b"spaces")
+        write(os.path.join(pages+"-private", "secret.txt"), b"secret")
+        bundle = os.urandom(300*1024)
+        write(os.path.join(static, "bundle.js"), bundle)
+
+        cache = ResourceCache(max_size=1024*1024)
+        cache.mount("http://kiosk/", pages)
+        server = start_server(static)
+        base = "http://127.0.0.1:%d/" % server.server_address[1]
+        cache.cache(base)
+
+        # Mounted files
+        handler = cache.get_handler(Request("http://kiosk/"))
+        assert isinstance(handler, FileHandler)
+        response, length, body = load(handler)
+        assert (response.status, response.mime_type, body) == (200, "text/html", b"<h1>Start</h1>")
+        response, length, body = load(cache.get_handler(Request("http://kiosk/two%20words.html?x=1")))
+        assert body == b"spaces"
+        for url in ("http://kiosk/../pages-private/secret.txt",
+                    "http://kiosk/%2e%2e/pages-private/secret.txt",
+                    "http://kiosk/missing.html"):
+            assert cache.find_file(url) is None, url
+        assert cache.get_handler(Request("http://kiosk/", "POST")) is None
+
+        # Fetched, then served from memory
+        start = time.time()
+        handler = cache.get_handler(Request(base+"bundle.js"))
+        assert isinstance(handler, FetchHandler)
+        response, length, body = load(handler, 16*1024)
+        fetch_time = time.time()-start
+        assert (response.status, length, body) == (200, len(bundle), bundle)
+        start = time.time()
+        handler = cache.get_handler(Request(base+"bundle.js"))
+        assert isinstance(handler, MemoryHandler)
+        response, length, body = load(handler, 16*1024)
+        memory_time = time.time()-start
+        assert (response.status, body) == (200, bundle)
+
+        # Large downloads don't pile up in memory while CEF reads slowly
+        cache.read_ahead = 64*1024
+        cache.max_entry_size = 256*1024
+        write(os.path.join(static, "download.bin"), bundle*4)
+        handler = cache.get_handler(Request(base+"download.bin"))
+        callback = Callback()
+        handler.ProcessRequest(Request(handler.url), callback)
+        callback.wait()
+        time.sleep(0.2)
+        assert handler.buffered <= cache.read_ahead+cache.chunk_size, handler.buffered
+        handler.Cancel()
+        response, length, body = load(cache.get_handler(Request(base+"download.bin")))
+        assert body == bundle*4 and cache.get(base+"download.bin") is None
+
+        # Errors are passed on, not cached
+        response, length, body = load(cache.get_handler(Request(base+"missing.js")))
+        assert response.status == 404
+        assert cache.get(base+"missing.js") is None
+
+        # Stale entries are served while the server is down
+        server.shutdown()
+        server.server_close()
+        cache.max_age = 0.001
+        time.sleep(0.01)
+        handler = cache.get_handler(Request(base+"bundle.js"))
+        assert isinstance(handler, FetchHandler)
+        response, length, body = load(handler)
+        assert (response.status, body) == (200, bundle)
+        response, length, body = load(cache.get_handler(Request(base+"other.js")))
+        assert response.status == 502
+
+        stats = cache.stats()
+        assert stats["stale_hits"] == 1 and not cache.handlers
+        print("fetch %.1f ms, memory %.1f ms (%d KB)" % (fetch_time*1000, memory_time*1000, len(bundle)//1024))
+        print(stats)
+        print("OK")
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
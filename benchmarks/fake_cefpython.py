@@ -0,0 +1,229 @@
+"""
+Fake cefpython module.
+Implements the parts of the cefpython API cefkivy uses, so the render and
+input paths can be benchmarked without a CEF build. install() registers it
+as cefpython3.cefpython before cefkivy imports it.
+"""
+import ctypes
+import sys
+import types
+
+# Constants
+PET_VIEW = 0
+PET_POPUP = 1
+MOUSEBUTTON_LEFT = 0
+MOUSEBUTTON_MIDDLE = 1
+MOUSEBUTTON_RIGHT = 2
+EVENTFLAG_NONE = 0
+EVENTFLAG_CAPS_LOCK_ON = 1 << 0
+EVENTFLAG_SHIFT_DOWN = 1 << 1
+EVENTFLAG_CONTROL_DOWN = 1 << 2
+EVENTFLAG_ALT_DOWN = 1 << 3
+KEYEVENT_RAWKEYDOWN = 0
+KEYEVENT_KEYDOWN = 1
+KEYEVENT_KEYUP = 2
+KEYEVENT_CHAR = 3
+LOGSEVERITY_INFO = 1
+
+_global_callbacks = {}
+_known_callbacks = ("OnCertificateError", "OnBeforePluginLoad", "OnAfterCreated")
+
+
+class PaintBuffer(object):
+    """
+    BGRA frame in memory owned by the fake, like the buffer CEF passes to
+    OnPaint.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.data = bytearray(width*height*4)
+        self._cdata = (ctypes.c_char*len(self.data)).from_buffer(self.data)
+
+    def GetIntPointer(self):
+        return ctypes.addressof(self._cdata)
+
+    def GetString(self, mode="bgra", origin="top-left"):
+        return bytes(self.data)
+
+
+class Frame(object):
+
+    def __init__(self, browser, main=True):
+        self.browser = browser
+        self.main = main
+        self.executed = 0
+
+    def IsMain(self):
+        return self.main
+
+    def GetParent(self):
+        return None
+
+    def GetUrl(self):
+        return self.browser.url
+
+    def ExecuteJavascript(self, code, url="", line=1):
+        self.executed += 1
+
+
+class Browser(object):
+    """
+    Counts the events sent to it instead of rendering anything.
+    """
+
+    def __init__(self, url=""):
+        self.url = url
+        self.handler = None
+        self.bindings = None
+        self.hidden = False
+        self.frame = Frame(self)
+        self.counts = {}
+
+    def _count(self, name):
+        self.counts[name] = self.counts.get(name, 0)+1
+
+    def SetClientHandler(self, handler):
+        self.handler = handler
+
+    def SetJavascriptBindings(self, bindings):
+        self.bindings = bindings
+
+    def SendFocusEvent(self, focus):
+        pass
+
+    def SendKeyEvent(self, event):
+        self._count("key")
+
+    def SendMouseClickEvent(self, x, y, button, mouseUp, clickCount):
+        self._count("click")
+
+    def SendMouseMoveEvent(self, x, y, mouseLeave):
+        self._count("move")
+
+    def SendMouseWheelEvent(self, x, y, deltaX, deltaY):
+        self._count("wheel")
+
+    def WasResized(self):
+        pass
+
+    def WasHidden(self, hidden):
+        self.hidden = hidden
+
+    def NotifyScreenInfoChanged(self):
+        pass
+
+    def Navigate(self, url):
+        self.url = url
+
+    def GetMainFrame(self):
+        return self.frame
+
+    def GetFocusedFrame(self):
+        return self.frame
+
+    def GoBack(self):
+        pass
+
+    def GoForward(self):
+        pass
+
+    def CloseBrowser(self, force=False):
+        pass
+
+
+class WindowInfo(object):
+
+    def SetAsOffscreen(self, handle):
+        pass
+
+
+class JavascriptBindings(object):
+
+    def __init__(self, bindToFrames=False, bindToPopups=False):
+        self.functions = {}
+
+    def SetFunction(self, name, func):
+        self.functions[name] = func
+
+
+class Cookie(object):
+
+    def __init__(self):
+        self.data = {}
+
+    def Set(self, data):
+        self.data = dict(data)
+
+    def Get(self):
+        return dict(self.data)
+
+
+class _CookieManager(object):
+
+    def __init__(self):
+        self.cookies = []
+
+    def SetStoragePath(self, path, persistSessionCookies=False):
+        pass
+
+    def SetCookie(self, url, cookie):
+        self.cookies.append(cookie)
+
+    def VisitAllCookies(self, visitor):
+        for i, cookie in enumerate(self.cookies):
+            if not visitor.Visit(cookie, i, len(self.cookies), [False]):
+                break
+        return True
+
+    def DeleteCookies(self, url, name):
+        self.cookies = []
+
+
+class CookieManager(object):
+    _manager = _CookieManager()
+
+    @classmethod
+    def GetGlobalManager(cls):
+        return cls._manager
+
+    @classmethod
+    def CreateManager(cls, path, persistSessionCookies=False):
+        return _CookieManager()
+
+
+def GetModuleDirectory():
+    return ""
+
+
+def Initialize(settings, switches=None):
+    pass
+
+
+def Shutdown():
+    pass
+
+
+def MessageLoopWork():
+    pass
+
+
+def SetGlobalClientCallback(name, callback):
+    if name not in _known_callbacks:
+        raise Exception("SetGlobalClientCallback() failed: invalid callback name = %s" % name)
+    _global_callbacks[name] = callback
+
+
+def CreateBrowserSync(windowInfo, browserSettings, navigateUrl=""):
+    return Browser(navigateUrl)
+
+
+def install():
+    """
+    Makes "from cefpython3 import cefpython" return this module.
+    """
+    package = types.ModuleType("cefpython3")
+    package.cefpython = sys.modules[__name__]
+    sys.modules["cefpython3"] = package
+    sys.modules["cefpython3.cefpython"] = sys.modules[__name__]
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Headless cefkivy benchmarks.
+Runs the paint, touch and key paths of cefkivy against the fake cefpython
+module and Kivy's mock GL backend, so no CEF build and no display are
+needed (Kivy doesn't even get a window). Texture uploads don't reach a GPU, the numbers show the Python side
+cost of each path and can be compared across versions:
+
+    python benchmarks/run.py --json bench_output.json
+"""
+import argparse
+import json
+import os
+import sys
+from timeit import default_timer as timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+os.environ.setdefault("KIVY_GL_BACKEND", "mock")
+# No window, not even on a desktop, so runs are comparable everywhere
+os.environ.setdefault("KIVY_WINDOW", "")
+
+
+class FakeWindow(object):
+    width = 1920
+    height = 1080
+
+    def release_all_keyboards(self):
+        pass
+
+    def set_vkeyboard_class(self, cls):
+        pass
+
+
+# Widgets insist on a window (EventLoop.ensure_window() exits without one),
+# cefkivy imports kivy.core.window.Window, and the window would set up the
+# GL backend the textures need.
+import kivy.core.window
+from kivy.base import EventLoop
+from kivy.graphics.cgl import cgl_init
+kivy.core.window.Window = FakeWindow()
+EventLoop.ensure_window = lambda: None
+cgl_init()
+
+import fake_cefpython
+fake_cefpython.install()
+
+from cefkivy.browser import CefBrowser
+
+
+RESOLUTIONS = [(1280, 720), (1920, 1080), (3840, 2160)]
+# Touch events per Kivy frame (240 Hz digitizer at 60 fps)
+MOVES_PER_FRAME = 4
+
+
+def paint_patterns(width, height):
+    """
+    Returns name -> function(frame number) -> dirty rects.
+    """
+    def full(i):
+        return [[0, 0, width, height]]
+
+    def caret(i):
+        return [[width//3, height//4, 2, 20]]
+
+    def spinner(i):
+        return [[width//2-32, height//2-32, 64, 64]]
+
+    def scattered(i):
+        return [[(i*97+j*211) % (width-40), (i*53+j*127) % (height-20), 40, 20]
+                for j in range(20)]
+
+    def scroll(i):
+        return [[0, height//2, width, height//2]]
+
+    return [("full", full), ("caret", caret), ("spinner", spinner),
+            ("scattered", scattered), ("scroll", scroll)]
+
+
+class FakeTouch(object):
+    """
+    The parts of a Kivy MotionEvent the browser widgets use.
+    """
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        self.pos = (x, y)
+        self.dx = 0
+        self.dy = 0
+        self.is_double_tap = False
+        self.grab_current = None
+
+    def move(self, x, y):
+        self.dx = x-self.x
+        self.dy = y-self.y
+        self.x = x
+        self.y = y
+        self.pos = (x, y)
+
+    def grab(self, widget):
+        self.grab_current = widget
+
+    def ungrab(self, widget):
+        self.grab_current = None
+
+
+def summarize(name, durations, extra=None):
+    durations = sorted(durations)
+    total = sum(durations)
+    result = {"name": name,
+              "count": len(durations),
+              "per_second": len(durations)/total if total else 0,
+              "mean_ms": total/len(durations)*1000,
+              "p95_ms": durations[int(len(durations)*0.95)-1]*1000,
+              "max_ms": durations[-1]*1000,
+              }
+    result.update(extra or {})
+    return result
+
+
+def create_browser(paint_thread=False):
+    widget = CefBrowser(url="about:blank", keyboard_mode="local", paint_thread=paint_thread)
+    widget.pos = (0, 0)
+    return widget
+
+
+def bench_paint(widget, frames):
+    results = []
+    handler = widget.browser.handler
+    for width, height in RESOLUTIONS:
+        widget.size = (width, height)
+        buf = fake_cefpython.PaintBuffer(width, height)
+        for name, pattern in paint_patterns(width, height):
+            durations = []
+            # Time OnPaint blocks the main thread
+            paint_durations = []
+            copied = widget.render_stats.bytes_copied.total
+            uploaded = widget.render_stats.bytes_uploaded.total
+            for i in range(frames):
+                start = timer()
+                handler.OnPaint(widget.browser, fake_cefpython.PET_VIEW, pattern(i),
+                                buf, width, height)
+                paint_durations.append(timer()-start)
+                # One Kivy frame per paint
+                widget.upload_frames()
+                durations.append(timer()-start)
+            results.append(summarize(
+                "paint %dx%d %s" % (width, height, name), durations,
+                {"onpaint_mean_ms": sum(paint_durations)/len(paint_durations)*1000,
+                 "mb_copied": (widget.render_stats.bytes_copied.total-copied)/1e6,
+                 "mb_uploaded": (widget.render_stats.bytes_uploaded.total-uploaded)/1e6}))
+    return results
+
+
+def bench_touch(widget, moves):
+    widget.size = (1920, 1080)
+    results = []
+
+    counts = widget.browser.counts
+    durations = []
+    sent = sum(counts.values())
+    touch = FakeTouch(100, 100)
+    widget.on_touch_down(touch)
+    for i in range(moves):
+        touch.move(100+i % 800, 100+i % 600)
+        start = timer()
+        widget.on_touch_move(touch)
+        if i % MOVES_PER_FRAME == MOVES_PER_FRAME-1:
+            widget.input_queue.flush()
+        durations.append(timer()-start)
+    widget.on_touch_up(touch)
+    results.append(summarize("touch drag", durations,
+                             {"events_sent": sum(counts.values())-sent}))
+
+    durations = []
+    sent = sum(counts.values())
+    touch1 = FakeTouch(100, 100)
+    touch2 = FakeTouch(300, 100)
+    widget.on_touch_down(touch1)
+    widget.on_touch_down(touch2)
+    for i in range(moves):
+        touch1.move(100, 100+i % 600)
+        touch2.move(300, 100+i % 600)
+        start = timer()
+        widget.on_touch_move(touch1)
+        widget.on_touch_move(touch2)
+        if i % MOVES_PER_FRAME == MOVES_PER_FRAME-1:
+            widget.input_queue.flush()
+        durations.append(timer()-start)
+    widget.on_touch_up(touch2)
+    widget.on_touch_up(touch1)
+    results.append(summarize("touch scroll", durations,
+                             {"events_sent": sum(counts.values())-sent}))
+
+    durations = []
+    for i in range(moves//10):
+        touch = FakeTouch(100+i % 800, 100+i % 600)
+        start = timer()
+        widget.on_touch_down(touch)
+        widget.on_touch_up(touch)
+        durations.append(timer()-start)
+    results.append(summarize("touch tap", durations))
+    return results
+
+
+def bench_keys(widget, repeat):
+    text = "The quick brown fox jumps over the lazy dog 0123456789\r\t\b"
+    keys = []
+    for char in text:
+        keycode = {"\r": 13, "\t": 9, "\b": 8}.get(char, ord(char.lower()))
+        keys.append(((keycode, char), char if keycode == ord(char.lower()) else None))
+    manager = widget.key_manager
+    durations = []
+    for i in range(repeat):
+        for keycode, char in keys:
+            start = timer()
+            manager.kivy_on_key_down(widget.browser, None, keycode, char, [])
+            manager.kivy_on_key_up(widget.browser, None, keycode)
+            durations.append(timer()-start)
+    results = [summarize("keys down+up", durations)]
+
+    # A 200 character scanner burst
+    burst = (text.strip()*4)[:200]
+    for mode in ("keys", "insert"):
+        durations = []
+        for i in range(repeat):
+            start = timer()
+            widget.send_text(burst, mode=mode)
+            durations.append(timer()-start)
+        results.append(summarize("send_text 200 chars %s" % mode, durations))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--frames", type=int, default=60, help="Paints per resolution and pattern")
+    parser.add_argument("--moves", type=int, default=2000, help="Touch moves per stream")
+    parser.add_argument("--keys", type=int, default=50, help="Repetitions of the key stream")
+    parser.add_argument("--paint-thread", action="store_true",
+                        help="Copy large frames on several threads (CefBrowser paint_thread)")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    widget = create_browser(args.paint_thread)
+    results = []
+    results += bench_paint(widget, args.frames)
+    results += bench_touch(widget, args.moves)
+    results += bench_keys(widget, args.keys)
+
+    print("%-36s %8s %12s %9s %9s %9s" % ("benchmark", "count", "per second", "mean ms", "p95 ms", "max ms"))
+    for r in results:
+        print("%-36s %8d %12.1f %9.3f %9.3f %9.3f" % (r["name"], r["count"], r["per_second"],
+                                                    r["mean_ms"], r["p95_ms"], r["max_ms"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": sys.version, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
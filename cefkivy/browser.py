@@ -1,31 +1,28 @@
-# Import cef as first module! (it's important)
-import ctypes
-import sys
+import json
 import os
-
-libcef_so = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libcef.so')
-if os.path.exists(libcef_so):
-    # Import local module
-    ctypes.CDLL(libcef_so, ctypes.RTLD_GLOBAL)
-    if 0x02070000 <= sys.hexversion < 0x03000000:
-        import cefpython_py27 as cefpython
-    else:
-        raise Exception("Unsupported python version: %s" % sys.version)
-else:
-    # Import from package
-    from cefpython3 import cefpython
-
+import time
 
 from kivy.app import App
 from kivy.base import EventLoop
 from kivy.graphics import Color, Rectangle
-from kivy.graphics.texture import Texture
 from kivy.properties import *
 from kivy.uix.widget import Widget
 from cefkeyboard import CefKeyboardManager
+from channel import CHANNEL_JS, MessageChannel
+from paint import FrameStage, StagingBuffer, TexturePool, texture_region
+from paintthread import ThreadedFrameStage
+from runtime import CefRuntime, cefpython
+from snapshot import Snapshots
+from stats import RenderStats
+from urlfilter import RESOURCE_TYPES
+from profiling import CallbackProfiler
+from inputqueue import InputQueue
 from kivy.clock import Clock
 from kivy.core.window import Window
 
+# CEF can only be initialized once per process, all browsers share it.
+runtime = CefRuntime()
+
 
 class CefBrowser(Widget):
     # Keyboard mode: "global" or "local".
@@ -33,27 +30,79 @@ class CefBrowser(Widget):
     # 2. Local mode forwards keys to CEF only when an editable
     #    control is focused (input type=text|password or textarea).
     keyboard_mode = OptionProperty("local", options=("global", "local"))
+    # Upload mode: "dirty" or "full".
+    # 1. Dirty mode only uploads the regions CEF reports as changed.
+    # 2. Full mode uploads the whole frame on every paint.
+    upload_mode = OptionProperty("dirty", options=("dirty", "full"))
+    # Maximum frames per second CEF renders at (0 = CEF's default)
+    max_fps = NumericProperty(0)
+    # Tell CEF the browser is hidden when it is not in the widget tree,
+    # fully transparent or has no size. Hidden browsers stop painting.
+    auto_hide = BooleanProperty(True)
+    hidden = BooleanProperty(False)
+    # Inject the keyboard bridge (local keyboard mode) into child frames
+    # as well, disable it if only the main frame has input fields.
+    keyboard_in_frames = BooleanProperty(True)
+    # Render pipeline statistics, refreshed every stats_interval seconds
+    # while collect_stats is True. See RenderStats.snapshot() for the keys.
+    collect_stats = BooleanProperty(True)
+    stats_interval = NumericProperty(1)
+    stats = DictProperty({})
     url = StringProperty("about:blank")
     current_url = StringProperty("")
     resources_dir = StringProperty("")
     browser = None
     popup = None
-    touches = []
     is_loading = BooleanProperty(True)
 
-    _reset_js_bindings = False  # See set_js_bindings()
     _js_bindings = None  # See set_js_bindings()
+    _swapping = False  # See swap_browser()
+    _last_upload = 0  # See upload_frames()
+    _navigate_time = None  # See on_url()
+    _await_first_paint = False  # See on_url()
+    _create_time = None  # See OnPaint()
+    first_paint_time = None  # Seconds from navigation to first paint
+    resize_delay = 0.1  # See realign()
 
     def __init__(self, *largs, **dargs):
         super(CefBrowser, self).__init__()
         self.url = dargs.get("url", "")
         self.keyboard_mode = dargs.get("keyboard_mode", "local")
+        self.upload_mode = dargs.get("upload_mode", "dirty")
+        self.max_fps = dargs.get("max_fps", 0)
+        self.auto_hide = dargs.get("auto_hide", True)
         self.resources_dir = dargs.get("resources_dir", "")
         self.keyboard_above_classes = dargs.get("keyboard_above_classes", [])
+        # A ResourceCache (see resources.py) serving local/cached resources
+        self.resource_cache = dargs.get("resource_cache")
+        # A RequestFilter (see urlfilter.py) blocking requests by rules
+        self.request_filter = dargs.get("request_filter")
+        # A Preloader (see preload.py) holding pages loaded ahead
+        self.preloader = dargs.get("preloader")
         switches = dargs.get("switches", {})
         self.__rect = None
         self.browser = None
+        self.touches = []
+        self.render_stats = RenderStats()
+        # Touch moves and wheel deltas get sent to CEF once per frame
+        self.input_queue = InputQueue(self)
+        if dargs.get("paint_thread"):
+            # Large frames get copied out of CEF's memory by several threads
+            self.frame_stage = ThreadedFrameStage()
+        else:
+            self.frame_stage = FrameStage()
+        # Browsers shown one at a time (e.g. tabs) can share the staging
+        # buffer and the texture pool
+        self.staging = dargs.get("staging") or StagingBuffer()
+        self.trigger_upload = Clock.create_trigger(self.upload_frames, -1)
+        self.texture_pool = dargs.get("texture_pool") or TexturePool()
+        self.texture_base = None
+        self.texture = None
+        # Size of the view as known to CEF, see notify_resize()
+        self.view_size = (int(self.width), int(self.height))
+        self.fit_texture(*self.view_size)
         self.popup = CefBrowserPopup(self)
+        self.snapshots = Snapshots(self)
 
         self.register_event_type("on_loading_state_change")
         self.register_event_type("on_address_change")
@@ -65,51 +114,38 @@ class CefBrowser(Widget):
         self.register_event_type("on_certificate_error")
         self.register_event_type("on_js_dialog")
         self.register_event_type("on_before_unload_dialog")
+        self.register_event_type("on_first_paint")
 
         self.key_manager = CefKeyboardManager(cefpython=cefpython, browser_widget=self)
 
-        self.texture = Texture.create(size=self.size, colorfmt='rgba', bufferfmt='ubyte')
-        self.texture.flip_vertical()
         with self.canvas:
             Color(1, 1, 1)
             self.__rect = Rectangle(pos=self.pos, size=self.size, texture=self.texture)
 
-        md = cefpython.GetModuleDirectory()
-
-        # Determine if default resources dir should be used or a custom
-        if self.resources_dir:
-            resources = self.resources_dir
-        else:
-            resources = md
-
-        def cef_loop(*largs):
-            cefpython.MessageLoopWork()
-        Clock.schedule_interval(cef_loop, 0)
-
-        settings = {
-                    #"debug": True,
-                    "log_severity": cefpython.LOGSEVERITY_INFO,
-                    #"log_file": "debug.log",
-                    "persist_session_cookies": True,
-                    "release_dcheck_enabled": True,  # Enable only when debugging.
-                    "locales_dir_path": os.path.join(md, "locales"),
-                    "browser_subprocess_path": "%s/%s" % (cefpython.GetModuleDirectory(), "subprocess")
-                }
-        cefpython.Initialize(settings, switches)
+        # Only the first browser initializes CEF
+        runtime.initialize(switches, self.resources_dir)
+        # The adaptive message pump is shared by all browsers
+        self.pump = runtime.pump
+        runtime.register(self)
+        # Browsers with a cookie_path keep their cookies apart from the others
+        self.cookie_store = runtime.cookie_store(dargs.get("cookie_path"))
 
         windowInfo = cefpython.WindowInfo()
         windowInfo.SetAsOffscreen(0)
-        cefpython.SetGlobalClientCallback("OnCertificateError", self.OnCertificateError)
+        self._create_time = time.time()
         self.browser = cefpython.CreateBrowserSync(windowInfo, {}, navigateUrl=self.url)
-
-        # Set cookie manager
-        cookie_manager = cefpython.CookieManager.GetGlobalManager()
-        cookie_path = os.path.join(resources, "cookies")
-        cookie_manager.SetStoragePath(cookie_path, True)
+        runtime.record_timing("create_browser", time.time()-self._create_time)
 
         self.browser.SendFocusEvent(True)
-        ch = ClientHandler(self)
-        self.browser.SetClientHandler(ch)
+        self.client_handler = ClientHandler(self)
+        self.channel = MessageChannel(self)
+        self.channel.register("keyboard_update", self.keyboard_update)
+        self.trigger_hide_keyboard = Clock.create_trigger(self.release_keyboard, -1)
+        self.profiler = None
+        if dargs.get("profile_callbacks"):
+            self.enable_profiling()
+        else:
+            self.browser.SetClientHandler(self.client_handler)
         self.set_js_bindings()
         self.browser.WasResized()
         self.bind(size=self.realign)
@@ -117,46 +153,129 @@ class CefBrowser(Widget):
         self.bind(keyboard_mode=self.set_keyboard_mode)
         if self.keyboard_mode == "global":
             self.request_keyboard()
+        self.on_max_fps(self, self.max_fps)
+        # The runtime checks the visibility periodically as well
+        self.trigger_visibility = Clock.create_trigger(self.update_visibility)
+        self.bind(parent=self.trigger_visibility, size=self.trigger_visibility,
+                  opacity=self.trigger_visibility, auto_hide=self.trigger_visibility)
+        self.trigger_visibility()
+        self.bind(stats_interval=self.schedule_stats)
+        self.schedule_stats()
+
+    def schedule_stats(self, *largs):
+        Clock.unschedule(self.update_stats)
+        Clock.schedule_interval(self.update_stats, self.stats_interval)
+
+    def update_stats(self, *largs):
+        if self.collect_stats:
+            self.stats = self.get_stats()
+
+    def get_stats(self):
+        """
+        Returns the current render pipeline statistics as dict.
+        """
+        stats = self.render_stats.snapshot(self.frame_counters(), self.pump)
+        if self.resource_cache:
+            for name, value in self.resource_cache.stats().items():
+                stats["resource_cache_%s" % name] = value
+        if self.request_filter:
+            stats["requests_checked"] = self.request_filter.checked
+            stats["requests_blocked"] = self.request_filter.blocked
+        return stats
+
+    def enable_profiling(self):
+        """
+        Records calls and durations of all ClientHandler callbacks and
+        dispatched events in self.profiler (a CallbackProfiler).
+        """
+        if not self.profiler:
+            self.profiler = CallbackProfiler()
+            self.profiler.wrap(self.client_handler, "ClientHandler")
+            self.profiler.wrap_dispatch(self)
+        # cefpython looks the callbacks up when the handler gets set
+        self.browser.SetClientHandler(self.client_handler)
+
+    def disable_profiling(self):
+        if self.profiler:
+            self.profiler.restore()
+            self.profiler = None
+            self.browser.SetClientHandler(self.client_handler)
+
+    def input_activity(self):
+        """
+        Called for every input event forwarded to CEF.
+        """
+        if self.collect_stats:
+            self.render_stats.input_events.add()
+        self.pump.notify_activity()
+
+    def close(self):
+        """
+        Closes the CEF browser and unregisters it from the runtime. The widget
+        can't be used anymore afterwards.
+        """
+        if not self.browser:
+            return
+        self.release_keyboard()
+        Clock.unschedule(self.update_stats)
+        self.input_queue.clear()
+        self.channel.cancel_evaluations("Browser closed")
+        runtime.unregister(self)
+        browser = self.browser
+        self.browser = None
+        browser.CloseBrowser(True)
 
     def set_js_bindings(self):
-        # Needed to introduce set_js_bindings again because the freeze of sites at load took over.
-        # As an example 'http://www.htmlbasix.com/popup.shtml' freezed every time. By setting the js
-        # bindings again, the freeze rate is at about 35%. Check git to see how it was done, before using
-        # this function ...
-        # I (jegger) have to be honest, that I don't have a clue why this is acting like it does!
-        # I hope simon (REN-840) can resolve this once in for all...
-        #
-        # ORIGINAL COMMENT:
-        # When browser.Navigate() is called, some bug appears in CEF
-        # that makes CefRenderProcessHandler::OnBrowserDestroyed()
-        # is being called. This destroys the javascript bindings in
-        # the Render process. We have to make the js bindings again,
-        # after the call to Navigate() when OnLoadingStateChange()
-        # is called with isLoading=False. Problem reported here:
-        # http://www.magpcss.org/ceforum/viewtopic.php?f=6&t=11009
+        # Python functions are exposed through the message channel (see
+        # channel.py), so the bindings are only set once. They used to be
+        # set again after every Navigate(), because CEF destroys them in the
+        # render process then (http://www.magpcss.org/ceforum/viewtopic.php?f=6&t=11009),
+        # which froze sites at load. The channel falls back to console
+        # messages when the binding is gone.
         if not self._js_bindings:
             self._js_bindings = cefpython.JavascriptBindings(bindToFrames=True, bindToPopups=True)
-            self._js_bindings.SetFunction("__kivy__keyboard_update", self.keyboard_update)
+            self._js_bindings.SetFunction("__kivy__channel", self.channel.receive)
         self.browser.SetJavascriptBindings(self._js_bindings)
 
+    def register_js_function(self, name, func):
+        """
+        Makes func callable from JS in every frame as kivy.call(name, ...),
+        which returns a Promise of the result, or kivy.notify(name, ...).
+        Arguments and result have to be JSON serializable.
+        """
+        self.channel.register(name, func)
+
+    def unregister_js_function(self, name):
+        self.channel.unregister(name)
+
+    def evaluate_js(self, code, timeout=5):
+        """
+        Evaluates a JS expression in the main frame. Returns a JSFuture
+        (see channel.py) which gets the result on the Kivy thread; Promises
+        get awaited. Fails with JavascriptTimeout after timeout seconds and
+        with JavascriptCancelled when the page navigates away.
+        """
+        return self.channel.evaluate([code], timeout, single=True)
+
+    def evaluate_js_batch(self, codes, timeout=5):
+        """
+        Evaluates many expressions in one renderer round-trip. The JSFuture
+        gets the list of results, failed expressions have a JavascriptError
+        in their place.
+        """
+        return self.channel.evaluate(codes, timeout)
+
     def realign(self, *largs):
-        ts = self.texture.size
-        ss = self.size
-        schg = (ts[0] != ss[0] or ts[1] != ss[1])
-        if schg:
-            self.texture = Texture.create(size=self.size, colorfmt='rgba', bufferfmt='ubyte')
-            self.texture.flip_vertical()
         if self.__rect:
-            with self.canvas:
-                Color(1, 1, 1)
-                self.__rect.pos = self.pos
-                if schg:
-                    self.__rect.size = self.size
-            if schg:
-                self.update_rect()
-        if self.browser:
-            self.browser.WasResized()
-            self.browser.NotifyScreenInfoChanged()
+            # Until CEF painted at the new size, the last frame gets scaled
+            self.__rect.pos = self.pos
+            self.__rect.size = self.size
+        if self.view_size != (int(self.width), int(self.height)):
+            # Only tell CEF about the new size once it stopped changing,
+            # otherwise it re-layouts and repaints at every step of an
+            # animated resize.
+            Clock.unschedule(self.notify_resize)
+            Clock.schedule_once(self.notify_resize, self.resize_delay)
         # Bring keyboard to front
         try:
             k = self.__keyboard.widget
@@ -166,14 +285,175 @@ class CefBrowser(Widget):
         except:
             pass
 
+    def notify_resize(self, *largs):
+        self.view_size = (int(self.width), int(self.height))
+        if self.browser:
+            self.browser.WasResized()
+            self.browser.NotifyScreenInfoChanged()
+
+    def fit_texture(self, width, height):
+        """
+        Switches to a texture of the given size, taken from the texture pool.
+        """
+        self.texture_base = self.texture_pool.get(width, height, self.texture_base)
+        self.texture = texture_region(self.texture_base, width, height)
+        self.frame_stage.invalidate()
+        self.update_rect()
+
     def update_rect(self):
         if self.__rect:
             self.__rect.texture = self.texture
 
+    def release_frame(self):
+        """
+        Frees the frame copy and gives the texture back to the texture pool,
+        e.g. while the browser is in the background. The next paint brings
+        them back.
+        """
+        self.frame_stage.release()
+        self.popup.frame_stage.release()
+        if self.texture_base is not None:
+            self.texture_pool.release(self.texture_base)
+        self.texture_base = None
+        self.texture = None
+        self.update_rect()
+
+    def snapshot(self, size, callback, as_texture=True):
+        """
+        Downscales the latest frame to size in the background and calls
+        callback with the texture (or array), see snapshot.Snapshots.
+        """
+        self.snapshots.snapshot(size, callback, as_texture)
+
+    def upload_frames(self, *largs):
+        """
+        Uploads the latest frames painted by CEF into the textures. Scheduled
+        by OnPaint, runs once before the next Kivy frame gets drawn.
+        """
+        if self.max_fps:
+            # Older CEF versions can't limit the frame rate themselves
+            wait = self._last_upload+1./self.max_fps-Clock.get_time()
+            if wait > 0:
+                Clock.unschedule(self._deferred_upload)
+                Clock.schedule_once(self._deferred_upload, wait)
+                return
+            self._last_upload = Clock.get_time()
+        full = self.upload_mode == "full"
+        start = time.time()
+        uploaded = 0
+        stage = self.frame_stage
+        if stage.pending and (self.texture is None or tuple(self.texture.size) != (stage.width, stage.height)):
+            # CEF painted at a new size (or the texture got released). A
+            # hidden browser that released its texture gets none until it's
+            # shown again.
+            if self.texture is not None or not self.hidden:
+                self.fit_texture(stage.width, stage.height)
+        stage = self.popup.frame_stage
+        if stage.pending and stage.deferring and self.popup.parent:
+            # The popup is shown but OnPopupSize didn't catch up with the
+            # frame until now, so show it at the size CEF painted it.
+            self.popup.fit_texture(stage.width, stage.height)
+        for target in (self, self.popup):
+            if target.texture is None:
+                continue
+            target_uploaded = target.frame_stage.upload(target.texture, self.staging, full)
+            if target_uploaded:
+                target.update_rect()
+                uploaded += target_uploaded
+        if uploaded and self.collect_stats:
+            self.render_stats.uploads.add()
+            self.render_stats.bytes_uploaded.add(uploaded)
+            self.render_stats.upload_time.add(time.time()-start)
+        if stage.deferring and self.popup.parent:
+            # Give OnPopupSize one more frame to catch up
+            Clock.unschedule(self._deferred_upload)
+            Clock.schedule_once(self._deferred_upload)
+
+    def frame_counters(self):
+        """
+        Returns the paint counters (painted, uploaded, skipped, deferred,
+        dropped) of the view and the popup.
+        """
+        return {"view": self.frame_stage.counters(),
+                "popup": self.popup.frame_stage.counters()}
+
+    def _deferred_upload(self, *largs):
+        self.trigger_upload()
+
+    def on_max_fps(self, instance, value):
+        if self.browser and hasattr(self.browser, "SetWindowlessFrameRate"):
+            # Only available in newer CEF versions. CEF takes whole frame
+            # rates, fractions below 1 (e.g. background tabs) get 1, the
+            # upload throttling in upload_frames() keeps the exact rate.
+            self.browser.SetWindowlessFrameRate(max(1, int(round(value))) if value else 30)
+
+    def is_visible(self):
+        return bool(self.get_root_window() and self.width > 0
+                    and self.height > 0 and self.opacity > 0)
+
+    def update_visibility(self, *largs):
+        """
+        Tells CEF whether the browser is hidden, see auto_hide.
+        """
+        if not self.browser:
+            return
+        hidden = self.auto_hide and not self.is_visible()
+        if hidden == self.hidden:
+            return
+        self.hidden = hidden
+        self.browser.WasHidden(hidden)
+        if not hidden:
+            self.browser.WasResized()
+            self.pump.notify_activity()
+            # A frame painted while hidden still waits for a texture
+            self.trigger_upload()
+
     def on_url(self, instance, value):
-        if self.browser and value:
+        if self.browser and value and not self._swapping:
+            # Time to first paint gets measured for real pages only
+            self._navigate_time = time.time() if value != "about:blank" else None
+            self._await_first_paint = False
+            self.channel.cancel_evaluations("Navigation")
+            preloaded = self.preloader.take(value) if self.preloader else None
+            if preloaded:
+                previous_url = self.current_url
+                self.swap_browser(preloaded)
+                # The page shown before stays preloaded
+                self.preloader.put(previous_url, preloaded)
+                # The loaded page only needs to paint
+                self._await_first_paint = self._navigate_time is not None
+                return
             self.browser.Navigate(self.url)
-            self._reset_js_bindings = True
+
+    def swap_browser(self, other):
+        """
+        Exchanges the CEF browser, and with it the loaded page, with the one
+        of the other browser widget. Pending JS evaluations of both get
+        cancelled.
+        """
+        self.release_keyboard()
+        other.release_keyboard()
+        self.browser, other.browser = other.browser, self.browser
+        self.current_url, other.current_url = other.current_url, self.current_url
+        self.is_loading, other.is_loading = other.is_loading, self.is_loading
+        other._swapping = True
+        other.url = other.current_url or "about:blank"
+        other._swapping = False
+        for widget in (self, other):
+            widget.channel.cancel_evaluations("Browser swapped")
+            widget.input_queue.clear()
+            widget.popup.frame_stage.drop()
+            widget.remove_widget(widget.popup)
+            # Callbacks and binding calls of the page go to the new widget
+            widget.browser.SetClientHandler(widget.client_handler)
+            widget.set_js_bindings()
+            widget.on_max_fps(widget, widget.max_fps)
+            widget.browser.WasHidden(widget.hidden)
+            widget.notify_resize()
+            # The pump tracks loading per widget, not per CEF browser
+            widget.pump.set_busy(widget, widget.is_loading)
+        if not self.hidden:
+            self.pump.notify_activity()
 
     def set_keyboard_mode(self, *largs):
         if self.keyboard_mode == "global":
@@ -183,6 +463,7 @@ class CefBrowser(Widget):
 
     def on_loading_state_change(self, isLoading, canGoBack, canGoForward):
         self.is_loading = isLoading
+        self.pump.set_busy(self, isLoading)
 
     def on_address_change(self, frame, url):
         self.current_url = url
@@ -207,6 +488,9 @@ class CefBrowser(Widget):
     def on_load_start(self, frame):
         pass
 
+    def on_first_paint(self, duration):
+        pass
+
     def on_load_end(self, frame, httpStatusCode):
         pass
 
@@ -230,8 +514,11 @@ class CefBrowser(Widget):
         :param shown: Show keyboard if true, hide if false (blur)
         :param rect: [x,y,width,height] of the input element
         :param attributes: Attributes of HTML element
+        Hides are done before the next frame, a show arriving until then
+        (focus moving to another element, maybe in another frame) cancels it.
         """
         if shown:
+            self.trigger_hide_keyboard.cancel()
             # Check if keyboard should get displayed above
             above = False
             if 'class' in attributes:
@@ -277,7 +564,7 @@ class CefBrowser(Widget):
                         x = Window.width-kb.width*kb.scale
                 kb.pos = (x, y)
         else:
-            self.release_keyboard()
+            self.trigger_hide_keyboard()
 
     def request_keyboard(self):
         if not self.__keyboard:
@@ -305,11 +592,36 @@ class CefBrowser(Widget):
         self.__keyboard = None
 
     def on_key_down(self, *largs):
+        self.input_activity()
         self.key_manager.kivy_on_key_down(self.browser, *largs)
 
     def on_key_up(self, *largs):
+        self.input_activity()
         self.key_manager.kivy_on_key_up(self.browser, *largs)
 
+    def send_text(self, text, mode="keys"):
+        """
+        Injects a whole string into the focused element, e.g. a scanned
+        barcode or pasted text.
+        :param mode: "keys" sends one KEYEVENT_CHAR per character in one go,
+                     "insert" inserts the text with a single JS call (one
+                     input event on the page instead of one per key).
+        """
+        if not self.browser or not text:
+            return
+        self.pump.notify_activity()
+        if mode == "insert":
+            if isinstance(text, bytes):
+                text = text.decode("utf-8")
+            self.browser.GetFocusedFrame().ExecuteJavascript(
+                "document.execCommand('insertText', false, %s);" % json.dumps(text))
+            sent = 1
+        else:
+            sent = self.key_manager.send_text(self.browser, text)
+        if self.collect_stats:
+            self.render_stats.input_events.add(len(text))
+            self.render_stats.input_sent.add(sent)
+
     def go_back(self):
         self.browser.GoBack()
 
@@ -318,16 +630,14 @@ class CefBrowser(Widget):
 
     def delete_cookie(self, url=""):
         """ Deletes the cookie with the given url. If url is empty all cookies get deleted.
+        See cookie_store for the other cookie functions (bulk export/import).
         """
-        cookie_manager = cefpython.CookieManager.GetGlobalManager()
-        if cookie_manager:
-            cookie_manager.DeleteCookies(url, "")
-        else:
-            print("No cookie manager found!, Can't delete cookie(s)")
+        self.cookie_store.delete_cookies(url)
 
     def on_touch_down(self, touch, *kwargs):
         if not self.collide_point(*touch.pos):
             return
+        self.input_activity()
         if self.keyboard_mode == "global":
             self.request_keyboard()
         else:
@@ -344,6 +654,7 @@ class CefBrowser(Widget):
     def on_touch_move(self, touch, *kwargs):
         if touch.grab_current is not self:
             return
+        self.input_activity()
 
         y = self.height-touch.pos[1] + self.pos[1]
         x = touch.x - self.pos[0]
@@ -352,9 +663,9 @@ class CefBrowser(Widget):
             # Dragging
             if (abs(touch.dx) > 5 or abs(touch.dy) > 5) or touch.is_dragging:
                 if touch.is_dragging:
-                    self.browser.SendMouseMoveEvent(x, y, mouseLeave=False)
+                    self.input_queue.move(x, y)
                 else:
-                    self.browser.SendMouseClickEvent(x, y, cefpython.MOUSEBUTTON_LEFT,
+                    self.input_queue.click(x, y, cefpython.MOUSEBUTTON_LEFT,
                                                      mouseUp=False, clickCount=1)
                     touch.is_dragging = True
         elif len(self.touches) == 2:
@@ -365,12 +676,13 @@ class CefBrowser(Widget):
             if (abs(dx) > 5 or abs(dy) > 5) or touch.is_scrolling:
                 # Scrolling
                 touch.is_scrolling = True
-                self.browser.SendMouseWheelEvent(touch.x, self.height-touch.pos[1], dx, -dy)
+                self.input_queue.wheel(touch.x, self.height-touch.pos[1], dx, -dy)
         return True
 
     def on_touch_up(self, touch, *kwargs):
         if touch.grab_current is not self:
             return
+        self.input_activity()
 
         y = self.height-touch.pos[1] + self.pos[1]
         x = touch.x - self.pos[0]
@@ -379,16 +691,16 @@ class CefBrowser(Widget):
             if not touch.is_scrolling:
                 # Right click (mouse down, mouse up)
                 self.touches[0].is_right_click = self.touches[1].is_right_click = True
-                self.browser.SendMouseClickEvent(x, y, cefpython.MOUSEBUTTON_RIGHT,
+                self.input_queue.click(x, y, cefpython.MOUSEBUTTON_RIGHT,
                                                  mouseUp=False, clickCount=1
                                                  )
-                self.browser.SendMouseClickEvent(x, y, cefpython.MOUSEBUTTON_RIGHT,
+                self.input_queue.click(x, y, cefpython.MOUSEBUTTON_RIGHT,
                                                  mouseUp=True, clickCount=1
                                                  )
         else:
             if touch.is_dragging:
                 # Drag end (mouse up)
-                self.browser.SendMouseClickEvent(
+                self.input_queue.click(
                     x,
                     y,
                     cefpython.MOUSEBUTTON_LEFT,
@@ -399,13 +711,13 @@ class CefBrowser(Widget):
                 count = 1
                 if touch.is_double_tap:
                     count = 2
-                self.browser.SendMouseClickEvent(
+                self.input_queue.click(
                     x,
                     y,
                     cefpython.MOUSEBUTTON_LEFT,
                     mouseUp=False, clickCount=count
                 )
-                self.browser.SendMouseClickEvent(
+                self.input_queue.click(
                     x,
                     y,
                     cefpython.MOUSEBUTTON_LEFT,
@@ -425,9 +737,11 @@ class CefBrowserPopup(Widget):
     def __init__ (self, parent, *largs, **dargs):
         super(CefBrowserPopup, self).__init__()
         self.browser_widget = parent
+        self.frame_stage = FrameStage()
         self.__rect = None
-        self.texture = Texture.create(size=self.size, colorfmt='rgba', bufferfmt='ubyte')
-        self.texture.flip_vertical()
+        self.texture_base = None
+        self.texture = None
+        self.fit_texture(*self.size)
         with self.canvas:
             Color(1, 1, 1)
             self.__rect = Rectangle(pos=self.pos, size=self.size, texture=self.texture)
@@ -439,26 +753,102 @@ class CefBrowserPopup(Widget):
     def realign(self, *largs):
         self.x = self.rx+self.browser_widget.x
         self.y = self.browser_widget.height-self.ry-self.height+self.browser_widget.y
-        ts = self.texture.size
-        ss = self.size
-        schg = (ts[0] != ss[0] or ts[1] != ss[1])
-        if schg:
-            self.texture = Texture.create(size=self.size, colorfmt='rgba', bufferfmt='ubyte')
-            self.texture.flip_vertical()
+        if tuple(self.texture.size) != (int(self.width), int(self.height)):
+            self.fit_texture(self.width, self.height)
+            self.browser_widget.trigger_upload()
         if self.__rect:
-            with self.canvas:
-                Color(1, 1, 1)
-                self.__rect.pos = self.pos
-                if schg:
-                    self.__rect.size = self.size
-            if schg:
-                self.update_rect()
+            self.__rect.pos = self.pos
+            self.__rect.size = self.size
+
+    def fit_texture(self, width, height):
+        pool = self.browser_widget.texture_pool
+        self.texture_base = pool.get(width, height, self.texture_base)
+        self.texture = texture_region(self.texture_base, width, height)
+        self.frame_stage.invalidate()
+        self.update_rect()
 
     def update_rect(self):
         if self.__rect:
             self.__rect.texture = self.texture
 
 
+# Keyboard bridge injected into every frame in local keyboard mode. It only
+# sends keyboard_update over the message channel when focus moves onto or away from an
+# editable element. The hide is sent right on blur so it stays in order with
+# the show of another frame, CefBrowser.keyboard_update() drops the pair.
+KEYBOARD_BRIDGE_JS = """
+(function() {
+if (window.__kivy__keyboard_bridge) return;  // Once per JS context
+window.__kivy__keyboard_bridge = true;
+window.print=function(){console.log("Print dialog blocked")}
+function isKeyboardElement(elem) {
+    var tag = elem.tagName ? elem.tagName.toUpperCase() : "";
+    if (tag=="INPUT") return (["TEXT", "PASSWORD", "DATE", "DATETIME", "DATETIME-LOCAL", "EMAIL", "MONTH", "NUMBER", "SEARCH", "TEL", "TIME", "URL", "WEEK"].indexOf(elem.type.toUpperCase())!=-1);
+    else if (tag=="TEXTAREA") return true;
+    else {
+        var tmp = elem;
+        while (tmp && tmp.contentEditable=="inherit") {
+            tmp = tmp.parentElement;
+        }
+        if (tmp && tmp.contentEditable && tmp.contentEditable!="false") return true;
+    }
+    return false;
+}
+
+function getRect(elem) {
+    %(rect)s
+}
+
+function getAttributes(elem) {
+    %(attributes)s
+}
+
+var current = null;
+
+window.addEventListener("focus", function (e) {
+    if (!isKeyboardElement(e.target)) return;
+    current = e.target;
+    kivy.notify("keyboard_update", true, getRect(current), getAttributes(current));
+}, true);
+
+window.addEventListener("blur", function (e) {
+    if (e.target !== current) return;
+    current = null;
+    kivy.notify("keyboard_update", false, [], {});
+}, true);
+
+window.__kivy__on_escape = function() {
+    if (document.activeElement) {
+        document.activeElement.blur();
+    }
+};
+})();
+"""
+_keyboard_bridge_cache = {}
+
+
+def keyboard_bridge_js(child_frame, send_class):
+    """
+    Returns the keyboard bridge script, built once per variant.
+    :param child_frame: Rects of elements in child frames aren't relative to
+                        the view, so none are sent.
+    :param send_class: Send the class attribute (for keyboard_above_classes),
+                       otherwise no attributes are sent.
+    """
+    key = (child_frame, send_class)
+    if key not in _keyboard_bridge_cache:
+        if child_frame:
+            rect = "return [];"
+        else:
+            rect = "var rect = elem.getBoundingClientRect(); return [rect.left, rect.top, rect.width, rect.height];"
+        if send_class:
+            attributes = "return elem.hasAttribute('class') ? {'class': elem.getAttribute('class')} : {};"
+        else:
+            attributes = "return {};"
+        _keyboard_bridge_cache[key] = KEYBOARD_BRIDGE_JS % {"rect": rect, "attributes": attributes}
+    return _keyboard_bridge_cache[key]
+
+
 class ClientHandler():
     def __init__(self, browserWidget):
         self.browser_widget = browserWidget
@@ -468,9 +858,6 @@ class ClientHandler():
     def OnLoadingStateChange(self, browser, isLoading, canGoBack, canGoForward):
         self.browser_widget.dispatch("on_loading_state_change", isLoading, canGoBack, canGoForward)
         bw = self.browser_widget
-        if bw._reset_js_bindings and not isLoading:
-            if bw:
-                bw.set_js_bindings()
         if isLoading and bw \
                 and bw.keyboard_mode == "local":
             # Release keyboard when navigating to a new page.
@@ -488,8 +875,12 @@ class ClientHandler():
     def OnStatusMessage(self, *largs):
         pass
 
-    def OnConsoleMessage(self, *largs):
-        pass
+    def OnConsoleMessage(self, browser, *largs):
+        # (message, source, line), newer cefpython versions pass the level first
+        for arg in largs[:2]:
+            if hasattr(arg, "startswith"):
+                return self.browser_widget.channel.on_console_message(arg)
+        return False
 
     # DownloadHandler
 
@@ -523,54 +914,18 @@ class ClientHandler():
     def OnLoadStart(self, browser, frame):
         self.browser_widget.dispatch("on_load_start", frame)
         bw = self.browser_widget
-        if bw and bw.keyboard_mode == "local":
-            lrectconstruct = "var rect = e.target.getBoundingClientRect();var lrect = [rect.left, rect.top, rect.width, rect.height];"
-            if frame.GetParent():
-                lrectconstruct = "var lrect = [];"
-            jsCode = """
-window.print=function(){console.log("Print dialog blocked")}
-function isKeyboardElement(elem) {
-    var tag = elem.tagName.toUpperCase();
-    if (tag=="INPUT") return (["TEXT", "PASSWORD", "DATE", "DATETIME", "DATETIME-LOCAL", "EMAIL", "MONTH", "NUMBER", "SEARCH", "TEL", "TIME", "URL", "WEEK"].indexOf(elem.type.toUpperCase())!=-1);
-    else if (tag=="TEXTAREA") return true;
-    else {
-        var tmp = elem;
-        while (tmp && tmp.contentEditable=="inherit") {
-            tmp = tmp.parentElement;
-        }
-        if (tmp && tmp.contentEditable) return true;
-    }
-    return false;
-}
-
-function getAttributes(elem){
-    var attributes = {}
-    for (var att, i = 0, atts = elem.attributes, n = atts.length; i < n; i++){
-        att = atts[i];
-        attributes[att.nodeName] = att.nodeValue
-    }
-    return attributes
-}
-
-window.addEventListener("focus", function (e) {
-    """+lrectconstruct+"""
-    attributes = getAttributes(e.target)
-    if (isKeyboardElement(e.target)) __kivy__keyboard_update(true, lrect, attributes);
-}, true);
-
-window.addEventListener("blur", function (e) {
-    """+lrectconstruct+"""
-    attributes = getAttributes(e.target)
-    __kivy__keyboard_update(false, lrect, attributes);
-}, true);
-
-function __kivy__on_escape() {
-    if (document.activeElement) {
-        document.activeElement.blur();
-    }
-}
-            """
-            frame.ExecuteJavascript(jsCode)
+        if frame.IsMain():
+            # Results of the old page won't arrive anymore
+            bw.channel.cancel_evaluations("Navigation")
+            if bw._navigate_time:
+                # Paints from now on show the new page
+                bw._await_first_paint = True
+        code = CHANNEL_JS
+        if bw.keyboard_mode == "local":
+            child = bool(frame.GetParent())
+            if not child or bw.keyboard_in_frames:
+                code += keyboard_bridge_js(child, bool(bw.keyboard_above_classes))
+        frame.ExecuteJavascript(code)
 
     def OnLoadEnd(self, browser, frame, httpStatusCode):
         self.browser_widget.dispatch("on_load_end", frame, httpStatusCode)
@@ -580,7 +935,10 @@ function __kivy__on_escape() {
         self.browser_widget.dispatch("on_load_error", frame, errorCode, errorText, failedUrl)
 
     def OnRendererProcessTerminated(self, *largs):
-        pass
+        # The new render process needs the channel binding again
+        bw = self.browser_widget
+        if bw.browser:
+            bw.set_js_bindings()
 
     # RenderHandler
 
@@ -588,7 +946,7 @@ function __kivy__on_escape() {
         pass
 
     def GetViewRect(self, browser, rect):
-        width, height = self.browser_widget.texture.size
+        width, height = self.browser_widget.view_size
         rect.append(0)
         rect.append(0)
         rect.append(width)
@@ -605,24 +963,36 @@ function __kivy__on_escape() {
         self.browser_widget.remove_widget(self.browser_widget.popup)
         if shown:
             self.browser_widget.add_widget(self.browser_widget.popup)
+        else:
+            self.browser_widget.popup.frame_stage.drop()
 
     def OnPopupSize(self, browser, rect):
         self.browser_widget.popup.rpos = (rect[0], rect[1])
         self.browser_widget.popup.size = (rect[2], rect[3])
 
     def OnPaint(self, browser, paintElementType, dirtyRects, buf, width, height):
-        b = buf.GetString(mode="bgra", origin="top-left")
         bw = self.browser_widget
         if paintElementType != cefpython.PET_VIEW:
-            if bw.popup.texture.width*bw.popup.texture.height*4!=len(b):
-                return True  # prevent segfault
-            bw.popup.texture.blit_buffer(b, colorfmt='bgra', bufferfmt='ubyte')
-            bw.popup.update_rect()
-            return True
-        if bw.texture.width*bw.texture.height*4!=len(b):
-            return True  # prevent segfault
-        bw.texture.blit_buffer(b, colorfmt='bgra', bufferfmt='ubyte')
-        bw.update_rect()
+            target = bw.popup
+        else:
+            target = bw
+        # Only copy the changed regions here. CEF may paint several times per
+        # Kivy frame, the texture gets updated once in upload_frames().
+        copied = target.frame_stage.paint(buf.GetIntPointer(), dirtyRects, width, height)
+        bw.trigger_upload()
+        if bw.collect_stats:
+            bw.render_stats.paints.add()
+            bw.render_stats.bytes_copied.add(copied)
+        if bw._create_time and target is bw:
+            runtime.record_timing("first_paint", time.time()-bw._create_time)
+            bw._create_time = None
+        if bw._await_first_paint and target is bw:
+            bw._await_first_paint = False
+            bw.first_paint_time = time.time()-bw._navigate_time
+            bw._navigate_time = None
+            bw.dispatch("on_first_paint", bw.first_paint_time)
+        # Painting pages are likely animating, keep pumping fast
+        bw.pump.notify_activity()
         return True
 
     def OnCursorChange(self, *largs):
@@ -633,14 +1003,41 @@ function __kivy__on_escape() {
 
     # RequestHandler
 
-    def OnBeforeBrowse(self, *largs):
-        pass
+    def OnBeforeBrowse(self, browser, frame, request, *largs):
+        request_filter = self.browser_widget.request_filter
+        if request_filter:
+            resource_type = "main_frame" if frame.IsMain() else "sub_frame"
+            return request_filter.is_blocked(request.GetUrl(), resource_type)
+        return False
 
-    def OnBeforeResourceLoad(self, *largs):
-        pass
+    def OnBeforeResourceLoad(self, browser, frame, request, *largs):
+        # Returning True cancels the request
+        request_filter = self.browser_widget.request_filter
+        if request_filter:
+            return request_filter.is_blocked(request.GetUrl(), self.resource_type(request))
+        return False
 
-    def GetResourceHandler(self, *largs):
-        pass
+    _resource_types = None
+
+    def resource_type(self, request):
+        """
+        Returns the resource type name of the request (see
+        urlfilter.RESOURCE_TYPES), None if cefpython doesn't tell.
+        """
+        if ClientHandler._resource_types is None:
+            ClientHandler._resource_types = dict(
+                (getattr(cefpython, "RT_"+name.upper()), name)
+                for name in RESOURCE_TYPES if hasattr(cefpython, "RT_"+name.upper()))
+        try:
+            return self._resource_types.get(request.GetResourceType())
+        except AttributeError:
+            return None
+
+    def GetResourceHandler(self, browser, frame, request):
+        cache = self.browser_widget.resource_cache
+        if cache:
+            return cache.get_handler(request)
+        return None
 
     def OnResourceRedirect(self, *largs):
         pass
@@ -652,11 +1049,8 @@ function __kivy__on_escape() {
         pass
 
     def GetCookieManager(self, browser, mainUrl):
-        cookie_manager = cefpython.CookieManager.GetGlobalManager()
-        if cookie_manager:
-            return cookie_manager
-        else:
-            print("No cookie manager found!")
+        # Called for every request (on the IO thread), the handle is cached
+        return self.browser_widget.cookie_store.manager
 
     def OnProtocolExecution(self, *largs):
         pass
@@ -677,5 +1071,5 @@ if __name__ == '__main__':
 
     CefApp().run()
 
-    cefpython.Shutdown()
+    runtime.shutdown()
 
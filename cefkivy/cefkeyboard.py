@@ -8,28 +8,72 @@ better readability.
 """
 
 
+# Kivy keycode -> CEF native key code of keys that differ
+OTHER_KEYS_MAP = {
+    # Escape
+    27: 65307,
+    # F1-F12
+    282: 65470, 283: 65471, 284: 65472, 285: 65473,
+    286: 65474, 287: 65475, 288: 65476, 289: 65477,
+    290: 65478, 291: 65479, 292: 65480, 293: 65481,
+    # Tab
+    9: 65289,
+    # Left Shift, Right Shift
+    304: 65505, 303: 65506,
+    # Left Ctrl, Right Ctrl
+    306: 65507, 305: 65508,
+    # Left Alt, Right Alt
+    308: 65513, 313: 65027,
+    # Backspace
+    8: 65288,
+    # Enter
+    13: 65293,
+    # PrScr, ScrLck, Pause
+    316: 65377, 302: 65300, 19: 65299,
+    # Insert, Delete,
+    # Home, End,
+    # Pgup, Pgdn
+    277: 65379, 127: 65535,
+    278: 65360, 279: 65367,
+    280: 65365, 281: 65366,
+    # Arrows (left, up, right, down)
+    276: 65361, 273: 65362, 275: 65363, 274: 65364,
+}
+# Same as list indexed by the Kivy keycode (0 = no translation)
+CEF_KEYCODES = [0]*(max(OTHER_KEYS_MAP)+1)
+for _keycode, _cef_keycode in OTHER_KEYS_MAP.items():
+    CEF_KEYCODES[_keycode] = _cef_keycode
+
+# Characters whose utf8 key-code somehow don't get recognized by cef
+CHAR_FIXES = {96: 39, 8220: 34}
+RETURN_KEY = 65293
+TAB_KEY = 65289
+
+# Bits of the modifier state, one per physical key
+SHIFT_LEFT = 1
+SHIFT_RIGHT = 2
+CTRL_LEFT = 4
+CTRL_RIGHT = 8
+ALT_LEFT = 16
+ALT_RIGHT = 32
+MODIFIER_KEYS = {304: SHIFT_LEFT, 303: SHIFT_RIGHT, 306: CTRL_LEFT,
+                 305: CTRL_RIGHT, 308: ALT_LEFT, 313: ALT_RIGHT}
+
+
 class CefKeyboardManager():
     # Kivy does not provide modifiers in on_key_up, but these
-    # must be sent to CEF as well.
-    is_shift1 = False
-    is_shift2 = False
-    is_ctrl1 = False
-    is_ctrl2 = False
-    is_alt1 = False
-    is_alt2 = False
+    # must be sent to CEF as well. Bitmask of the MODIFIER_KEYS held down.
+    modifier_state = 0
 
     def __init__(self, cefpython, browser_widget, *largs, **dargs):
         self.cefpython = cefpython
         self.browser_widget = browser_widget
-    
+        self._char_events = {}  # See send_text()
+        install_keyboard_class()
+
     def reset_all_modifiers(self):
-        self.is_shift1 = False
-        self.is_shift2 = False
-        self.is_ctrl1 = False
-        self.is_ctrl2 = False
-        self.is_alt1 = False
-        self.is_alt2 = False
-    
+        self.modifier_state = 0
+
     def kivy_on_key_down(self, browser, keyboard, keycode, text, modifiers):
         #print "\non_key_down:", keycode, text, modifiers
         if keycode[0] == 27:
@@ -56,14 +100,11 @@ class CefKeyboardManager():
         if cef_key_code == keycode[0] and text:
             cef_key_code = ord(text)
             # We have to convert the apostrophes as the utf8 key-code somehow don't get recognized by cef
-            if cef_key_code == 96:
-                cef_key_code = 39
-            if cef_key_code == 8220:
-                cef_key_code = 34
+            cef_key_code = CHAR_FIXES.get(cef_key_code, cef_key_code)
             event_type = self.cefpython.KEYEVENT_CHAR
 
         # When the key is the return key, send it as a KEYEVENT_CHAR as it will not work in textinputs
-        if cef_key_code == 65293:
+        if cef_key_code == RETURN_KEY:
             event_type = self.cefpython.KEYEVENT_CHAR
 
         key_event = {"type": event_type,
@@ -73,27 +114,17 @@ class CefKeyboardManager():
         #print("keydown keyEvent: %s" % key_event)
         browser.SendKeyEvent(key_event)
 
-        if keycode[0] == 304:
-            self.is_shift1 = True
-        elif keycode[0] == 303:
-            self.is_shift2 = True
-        elif keycode[0] == 306:
-            self.is_ctrl1 = True
-        elif keycode[0] == 305:
-            self.is_ctrl2 = True
-        elif keycode[0] == 308:
-            self.is_alt1 = True
-        elif keycode[0] == 313:
-            self.is_alt2 = True
+        self.modifier_state |= MODIFIER_KEYS.get(keycode[0], 0)
 
     def kivy_on_key_up(self, browser, keyboard, keycode):
         #print("\non_key_up(): keycode = %s" % (keycode,))
         cef_modifiers = self.cefpython.EVENTFLAG_NONE
-        if self.is_shift1 or self.is_shift2:
+        state = self.modifier_state
+        if state & (SHIFT_LEFT | SHIFT_RIGHT):
             cef_modifiers |= self.cefpython.EVENTFLAG_SHIFT_DOWN
-        if self.is_ctrl1 or self.is_ctrl2:
+        if state & (CTRL_LEFT | CTRL_RIGHT):
             cef_modifiers |= self.cefpython.EVENTFLAG_CONTROL_DOWN
-        if self.is_alt1:
+        if state & ALT_LEFT:
             cef_modifiers |= self.cefpython.EVENTFLAG_ALT_DOWN
 
         cef_key_code = self.translate_to_cef_keycode(keycode[0])
@@ -106,54 +137,44 @@ class CefKeyboardManager():
                         }
             browser.SendKeyEvent(key_event)
 
-        if keycode[0] == 304:
-            self.is_shift1 = False
-        elif keycode[0] == 303:
-            self.is_shift2 = False
-        elif keycode[0] == 306:
-            self.is_ctrl1 = False
-        elif keycode[0] == 305:
-            self.is_ctrl2 = False
-        elif keycode[0] == 308:
-            self.is_alt1 = False
-        elif keycode[0] == 313:
-            self.is_alt2 = False
+        self.modifier_state &= ~MODIFIER_KEYS.get(keycode[0], 0)
 
     def translate_to_cef_keycode(self, keycode):
-        cef_keycode = keycode
-        other_keys_map = {
-            # Escape
-            "27":65307,
-            # F1-F12
-            "282":65470, "283":65471, "284":65472, "285":65473,
-            "286":65474, "287":65475, "288":65476, "289":65477,
-            "290":65478, "291":65479, "292":65480, "293":65481,
-            # Tab
-            "9":65289,
-            # Left Shift, Right Shift
-            "304":65505, "303":65506,
-            # Left Ctrl, Right Ctrl
-            "306":65507, "305": 65508,
-            # Left Alt, Right Alt
-            "308":65513, "313":65027,
-            # Backspace
-            "8":65288,
-            # Enter
-            "13":65293,
-            # PrScr, ScrLck, Pause
-            "316":65377, "302":65300, "19":65299,
-            # Insert, Delete,
-            # Home, End,
-            # Pgup, Pgdn
-            "277":65379, "127":65535,
-            "278":65360, "279":65367,
-            "280":65365, "281":65366,
-            # Arrows (left, up, right, down)
-            "276":65361, "273":65362, "275":65363, "274":65364,
-        }
-        if str(keycode) in other_keys_map:
-            cef_keycode = other_keys_map[str(keycode)]
-        return cef_keycode
+        if 0 <= keycode < len(CEF_KEYCODES):
+            return CEF_KEYCODES[keycode] or keycode
+        return keycode
+
+    def send_text(self, browser, text):
+        """
+        Sends a whole string (e.g. a scanned barcode) as one sequence of
+        KEYEVENT_CHAR events, without going through Kivy's key events.
+        Newlines are sent as return, tabs as tab key press, all other
+        characters with their code point (CHAR_FIXES only applies to Kivy's
+        key codes). Returns the number of key events sent.
+        """
+        if isinstance(text, bytes):
+            text = text.decode("utf-8")
+        text = text.replace(u"\r\n", u"\n")
+        events = self._char_events
+        char_type = self.cefpython.KEYEVENT_CHAR
+        none = self.cefpython.EVENTFLAG_NONE
+        send = browser.SendKeyEvent
+        sent = 0
+        for char in text:
+            event = events.get(char)
+            if event is None:
+                if char in u"\r\n":
+                    event = [{"type": char_type, "native_key_code": RETURN_KEY, "modifiers": none}]
+                elif char == u"\t":
+                    event = [{"type": self.cefpython.KEYEVENT_KEYDOWN, "native_key_code": TAB_KEY, "modifiers": none},
+                             {"type": self.cefpython.KEYEVENT_KEYUP, "native_key_code": TAB_KEY, "modifiers": none}]
+                else:
+                    event = [{"type": char_type, "native_key_code": ord(char), "modifiers": none}]
+                events[char] = event
+            for key_event in event:
+                send(key_event)
+            sent += len(event)
+        return sent
 
 
 class FixedKeyboard(VKeyboard):
@@ -171,4 +192,17 @@ class FixedKeyboard(VKeyboard):
             return
         self.center_x = Window.width/2
         self.y = 230
-Window.set_vkeyboard_class(FixedKeyboard)
\ No newline at end of file
+
+
+_keyboard_class_installed = False
+
+
+def install_keyboard_class():
+    """
+    Makes Kivy use the FixedKeyboard. Done when the first keyboard manager
+    gets created instead of at import time.
+    """
+    global _keyboard_class_installed
+    if not _keyboard_class_installed:
+        Window.set_vkeyboard_class(FixedKeyboard)
+        _keyboard_class_installed = True
@@ -0,0 +1,360 @@
+"""
+Python <-> JS message channel.
+Instead of one JS binding per Python function, pages talk to Python through
+a single multiplexed channel: window.kivy.call(name, args...) queues the
+call, all calls made in the same JS turn get sent as one batch and the
+results come back in one batch as well.
+The batch goes through the __kivy__channel JS binding. If the binding got
+lost (CEF drops them on some navigations and on renderer restarts), it's
+sent as console message instead, which needs no binding at all. So the
+functions never have to be bound again, registering a new one doesn't touch
+the renderer either.
+JS can be evaluated from Python the same way, see MessageChannel.evaluate().
+"""
+import binascii
+import json
+import os
+from functools import partial
+
+from kivy.clock import Clock
+
+CONSOLE_PREFIX = "__kivy__channel:"
+STRING_TYPES = (str, type(u""))
+
+CHANNEL_JS = """
+(function() {
+if (window.kivy && window.kivy.__channel) return;  // Once per JS context
+var queue = [];
+var pending = {};
+var nextId = 1;
+var scheduled = false;
+// Results are only delivered to the main frame
+var isTop = (window === window.top);
+
+function flush() {
+    scheduled = false;
+    var batch = JSON.stringify(queue);
+    queue = [];
+    if (typeof window.__kivy__channel === "function") {
+        try {
+            window.__kivy__channel(batch);
+            return;
+        } catch (e) {}
+    }
+    console.log("%(prefix)s" + batch);
+}
+
+function send(name, args, wantReply, callback) {
+    var id = (isTop && wantReply) ? nextId++ : 0;
+    queue.push([id, name, args]);
+    if (!scheduled) {
+        scheduled = true;
+        if (window.Promise) Promise.resolve().then(flush);
+        else setTimeout(flush, 0);
+    }
+    if (!id) {
+        if (callback) callback(null, undefined);
+        return window.Promise ? Promise.resolve(undefined) : undefined;
+    }
+    if (window.Promise) {
+        return new Promise(function(resolve, reject) {
+            pending[id] = function(error, result) {
+                if (callback) callback(error, result);
+                if (error) reject(new Error(error));
+                else resolve(result);
+            };
+        });
+    }
+    pending[id] = callback || function() {};
+}
+
+window.kivy = {
+    __channel: true,
+    // kivy.call(name, arg1, arg2, ...) -> Promise of the result
+    call: function(name) {
+        return send(name, Array.prototype.slice.call(arguments, 1), true);
+    },
+    // kivy.callback(name, [args], function(error, result) {...})
+    callback: function(name, args, callback) {
+        return send(name, args || [], true, callback);
+    },
+    // kivy.notify(name, arg1, ...) -> no result
+    notify: function(name) {
+        send(name, Array.prototype.slice.call(arguments, 1), false);
+    }
+};
+
+window.__kivy__channel_reply = function(replies) {
+    for (var i = 0; i < replies.length; i++) {
+        var reply = replies[i];
+        var callback = pending[reply[0]];
+        if (!callback) continue;
+        delete pending[reply[0]];
+        callback(reply[1], reply[2]);
+    }
+};
+})();
+""" % {"prefix": CONSOLE_PREFIX}
+
+# Evaluates a list of expressions in the global scope and sends the results
+# back in one batch. Promises get awaited, values that aren't JSON
+# serializable are sent as string. The expressions are part of the script
+# (see eval_js()) instead of going through eval(), which a Content Security
+# Policy without 'unsafe-eval' blocks. The results carry the evaluation's
+# random token, any script can call __kivy__eval_result, but only this one
+# knows it.
+EVAL_JS = """
+(function(id, token, functions) {
+var results = new Array(functions.length);
+var waiting = functions.length;
+function settle(i, error, value) {
+    if (error === null) {
+        try {
+            JSON.stringify(value);
+        } catch (e) {
+            value = String(value);
+        }
+    }
+    results[i] = [error, value === undefined ? null : value];
+    if (--waiting === 0) kivy.notify("__kivy__eval_result", id, token, results);
+}
+functions.forEach(function(func, i) {
+    var value;
+    try {
+        value = func();
+    } catch (e) {
+        settle(i, String(e), null);
+        return;
+    }
+    if (value && typeof value.then === "function") {
+        value.then(function(v) { settle(i, null, v); },
+                   function(e) { settle(i, String(e), null); });
+    } else {
+        settle(i, null, value);
+    }
+});
+})(%(id)s, %(token)s, [%(functions)s]);
+"""
+
+
+def eval_js(call_id, token, codes):
+    """
+    Returns the EVAL_JS script evaluating codes. Each expression becomes the
+    return value of a function, the line breaks keep a trailing // comment
+    from swallowing the rest of the script.
+    """
+    functions = ",\n".join("function() { return (\n%s\n); }" % code.strip().rstrip(";")
+                            for code in codes)
+    return EVAL_JS % {"id": call_id, "token": json.dumps(token), "functions": functions}
+
+
+class JavascriptError(Exception):
+    """
+    An evaluated expression threw, or the evaluation didn't finish.
+    """
+
+
+class JavascriptTimeout(JavascriptError):
+    pass
+
+
+class JavascriptCancelled(JavascriptError):
+    pass
+
+
+class JSFuture(object):
+    """
+    Result of MessageChannel.evaluate(). Done callbacks get called on the
+    Kivy thread with the future as argument.
+    """
+
+    def __init__(self, channel=None, call_id=None):
+        self._channel = channel
+        self._call_id = call_id
+        self._callbacks = []
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def add_done_callback(self, callback):
+        if self.done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def get(self):
+        """
+        Returns the result or raises the error. Only valid once done.
+        """
+        if not self.done:
+            raise JavascriptError("Evaluation not finished yet")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def cancel(self):
+        if self._channel and not self.done:
+            self._channel.finish_evaluation(self._call_id, error=JavascriptCancelled("Cancelled"))
+
+    def _finish(self, result=None, error=None):
+        if self.done:
+            return
+        self.done = True
+        self.result = result
+        self.error = error
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+def is_valid_call(call):
+    return (isinstance(call, list) and len(call) == 3 and isinstance(call[0], int)
+            and isinstance(call[1], STRING_TYPES) and isinstance(call[2], list))
+
+
+class MessageChannel(object):
+
+    def __init__(self, browser_widget):
+        self.browser_widget = browser_widget
+        self.functions = {"__kivy__eval_result": self._eval_result}
+        self.evaluations = {}  # id -> [future, single, timeout trigger, token]
+        self._next_eval_id = 1
+        # Counters
+        self.batches = 0
+        self.calls = 0
+        self.console_batches = 0
+        self.errors = 0  # Malformed batches and calls, forged results, dropped
+
+    def register(self, name, func):
+        """
+        Makes func callable from JS as kivy.call(name, ...). The arguments
+        and the result have to be JSON serializable.
+        """
+        self.functions[name] = func
+
+    def unregister(self, name):
+        self.functions.pop(name, None)
+
+    def receive(self, batch):
+        """
+        Runs a batch of calls sent by JS and sends the results back.
+        Anything that isn't a list of [id, name, [args]] calls gets dropped
+        (any page can log a message with the channel's prefix).
+        """
+        self.batches += 1
+        try:
+            calls = json.loads(batch)
+        except (TypeError, ValueError):
+            self.errors += 1
+            return
+        if not isinstance(calls, list):
+            self.errors += 1
+            return
+        replies = []
+        for call in calls:
+            if not is_valid_call(call):
+                self.errors += 1
+                continue
+            call_id, name, args = call
+            self.calls += 1
+            func = self.functions.get(name)
+            if func is None:
+                error, result = "Unknown function: %s" % name, None
+            else:
+                try:
+                    error, result = None, func(*args)
+                except Exception as e:
+                    error, result = "%s: %s" % (type(e).__name__, e), None
+            if call_id:
+                replies.append([call_id, error, result])
+        if replies:
+            self.reply(replies)
+
+    def reply(self, replies):
+        browser = self.browser_widget.browser
+        if not browser:
+            return
+        try:
+            code = "window.__kivy__channel_reply && window.__kivy__channel_reply(%s);" % json.dumps(replies)
+        except (TypeError, ValueError) as e:
+            code = "window.__kivy__channel_reply && window.__kivy__channel_reply(%s);" % json.dumps(
+                [[call_id, "Result not serializable: %s" % e, None] for call_id, error, result in replies])
+        browser.GetMainFrame().ExecuteJavascript(code)
+
+    def on_console_message(self, message):
+        """
+        Returns True if the console message was a batch sent over the channel.
+        """
+        if not message.startswith(CONSOLE_PREFIX):
+            return False
+        self.console_batches += 1
+        self.receive(message[len(CONSOLE_PREFIX):])
+        return True
+
+    def evaluate(self, codes, timeout=None, single=False):
+        """
+        Evaluates the expressions in the main frame in one round-trip.
+        Only expressions, no statements: a syntax error in one of them
+        fails the whole batch (with JavascriptTimeout, if there is a
+        timeout). Returns a JSFuture of the list of results, an expression that threw
+        has a JavascriptError in its place. With single=True there has to be
+        one expression, its result is the result of the future and an error
+        fails the future.
+        """
+        call_id = self._next_eval_id
+        self._next_eval_id += 1
+        future = JSFuture(self, call_id)
+        browser = self.browser_widget.browser
+        if not browser:
+            future._finish(error=JavascriptCancelled("No browser"))
+            return future
+        if not codes:
+            future._finish(result=[])
+            return future
+        trigger = None
+        if timeout:
+            trigger = Clock.schedule_once(partial(self._eval_timeout, call_id), timeout)
+        token = binascii.hexlify(os.urandom(16)).decode("ascii")
+        self.evaluations[call_id] = [future, single, trigger, token]
+        # The channel may not be there yet, e.g. before the first OnLoadStart
+        code = CHANNEL_JS+eval_js(call_id, token, codes)
+        browser.GetMainFrame().ExecuteJavascript(code)
+        return future
+
+    def finish_evaluation(self, call_id, result=None, error=None):
+        entry = self.evaluations.pop(call_id, None)
+        if entry is None:
+            return
+        future, single, trigger, token = entry
+        if trigger is not None:
+            trigger.cancel()
+        future._finish(result, error)
+
+    def cancel_evaluations(self, reason="Cancelled"):
+        """
+        Fails all pending evaluations, e.g. because the page navigated away.
+        """
+        for call_id in list(self.evaluations):
+            self.finish_evaluation(call_id, error=JavascriptCancelled(reason))
+
+    def _eval_timeout(self, call_id, dt):
+        self.finish_evaluation(call_id, error=JavascriptTimeout("No result after %.1fs" % dt))
+
+    def _eval_result(self, call_id, token, results):
+        entry = self.evaluations.get(call_id)
+        if entry is None:
+            return  # Timed out or cancelled
+        if token != entry[3]:
+            # Not sent by the evaluation script
+            self.errors += 1
+            return
+        values = [JavascriptError(error) if error is not None else value
+                  for error, value in results]
+        if entry[1]:
+            value = values[0]
+            if isinstance(value, JavascriptError):
+                self.finish_evaluation(call_id, error=value)
+            else:
+                self.finish_evaluation(call_id, result=value)
+        else:
+            self.finish_evaluation(call_id, result=values)
@@ -0,0 +1,167 @@
+"""
+Cookie stores.
+Each store wraps one CEF cookie manager, created once and handed out on every
+GetCookieManager() call. Browsers share the global store (the cookies dir in
+the resources dir) unless they get a cookie_path of their own.
+Cookies can be exported and imported in bulk as plain dicts (JSON
+serializable), e.g. to provision a kiosk with logged in sessions:
+
+    store.save("session.json")
+    # On the kiosk
+    store.load("session.json")
+"""
+import calendar
+import datetime
+import json
+import threading
+import time
+
+from kivy.clock import Clock
+
+# Cookie dict keys holding datetimes, exported as UTC timestamps
+TIME_KEYS = ("creation", "lastAccess", "expires")
+
+
+def cookie_to_dict(cookie):
+    data = dict(cookie.Get())
+    for key in TIME_KEYS:
+        value = data.get(key)
+        if isinstance(value, datetime.datetime):
+            data[key] = calendar.timegm(value.utctimetuple())
+    return data
+
+
+def cookie_url(data):
+    """
+    Returns the URL a cookie gets set for when importing it.
+    """
+    scheme = "https" if data.get("secure") else "http"
+    return "%s://%s%s" % (scheme, data.get("domain", "").lstrip("."), data.get("path") or "/")
+
+
+class CookieExport(object):
+    """
+    Cookie visitor collecting the cookies. CEF visits them on its IO thread,
+    the callback gets the list on the Kivy thread.
+    """
+    # CEF doesn't call the visitor at all if there are no cookies, the export
+    # finishes when no cookie arrived for start_timeout (loading the cookie
+    # database can take a while) or, once cookies arrive, for idle_timeout
+    # since the last one.
+    start_timeout = 5
+    idle_timeout = 0.5
+
+    def __init__(self, store, callback):
+        self.store = store
+        self.callback = callback
+        self.cookies = []
+        self.finished = False
+        self.lock = threading.Lock()
+        self.started = None
+        self.last_visit = None
+
+    def start(self):
+        self.started = time.time()
+        Clock.schedule_once(self._check_idle, self.start_timeout)
+
+    def Visit(self, cookie, count, total, deleteCookie):
+        with self.lock:
+            if self.finished:
+                return False
+            self.cookies.append(cookie_to_dict(cookie))
+            self.last_visit = time.time()
+            done = count >= total-1
+        if done:
+            Clock.schedule_once(self._finish)
+        return not done
+
+    def _check_idle(self, *largs):
+        with self.lock:
+            if self.last_visit is None:
+                deadline = self.started+self.start_timeout
+            else:
+                deadline = self.last_visit+self.idle_timeout
+        remaining = deadline-time.time()
+        if remaining > 0:
+            Clock.schedule_once(self._check_idle, remaining)
+        else:
+            self._finish()
+
+    def _finish(self, *largs):
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+        Clock.unschedule(self._check_idle)
+        self.store.visitors.discard(self)
+        self.callback(self.cookies)
+
+
+class CookieStore(object):
+
+    def __init__(self, cefpython, path=None):
+        """
+        :param path: Storage directory, None for CEF's global cookie manager
+        """
+        self.path = path
+        if path is None:
+            self.manager = cefpython.CookieManager.GetGlobalManager()
+        else:
+            self.manager = cefpython.CookieManager.CreateManager(path, True)
+        self.cefpython = cefpython
+        # cefpython only keeps weak references to visitors
+        self.visitors = set()
+
+    def export_cookies(self, callback, url=None, include_http_only=True):
+        """
+        Visits all cookies (or the ones sent to url) in the background and
+        calls callback with a list of cookie dicts on the Kivy thread.
+        """
+        export = CookieExport(self, callback)
+        self.visitors.add(export)
+        if url:
+            started = self.manager.VisitUrlCookies(url, include_http_only, export)
+        else:
+            started = self.manager.VisitAllCookies(export)
+        if started is False:
+            print("Cookies can't be accessed, export is empty")
+            Clock.schedule_once(export._finish)
+        else:
+            export.start()
+        return export
+
+    def import_cookies(self, cookies):
+        """
+        Sets the cookie dicts as returned by export_cookies(). CEF stores
+        them on its IO thread, this call doesn't block on it.
+        """
+        for data in cookies:
+            data = dict(data)
+            url = data.pop("url", None) or cookie_url(data)
+            for key in TIME_KEYS:
+                if isinstance(data.get(key), (int, float)):
+                    data[key] = datetime.datetime.utcfromtimestamp(data[key])
+            cookie = self.cefpython.Cookie()
+            cookie.Set(data)
+            self.manager.SetCookie(url, cookie)
+
+    def save(self, path, callback=None):
+        """
+        Exports all cookies to a JSON file, callback gets called when written.
+        """
+        def write(cookies):
+            with open(path, "w") as f:
+                json.dump(cookies, f)
+            if callback:
+                callback(cookies)
+        return self.export_cookies(write)
+
+    def load(self, path):
+        with open(path) as f:
+            self.import_cookies(json.load(f))
+
+    def delete_cookies(self, url="", name=""):
+        """
+        Deletes the cookies of url (all if empty) named name (all if empty).
+        """
+        self.manager.DeleteCookies(url, name)
@@ -0,0 +1,74 @@
+"""
+Input coalescing.
+High rate touch digitizers deliver several motion events per frame. Sending
+each of them to CEF floods the renderer with IPC, so mouse moves are merged
+into the latest position and wheel deltas are summed up until the queue gets
+flushed once per frame. Clicks are never merged or reordered: a click
+flushes the pending events and is sent right away.
+"""
+from kivy.clock import Clock
+
+MOVE = 0
+WHEEL = 1
+
+
+class InputQueue(object):
+
+    def __init__(self, browser_widget):
+        self.browser_widget = browser_widget
+        self.events = []
+        self.trigger_flush = Clock.create_trigger(self.flush, -1)
+        # Counters
+        self.received = 0
+        self.sent = 0
+
+    def move(self, x, y):
+        self.received += 1
+        if self.events and self.events[-1][0] == MOVE:
+            self.events[-1] = [MOVE, x, y]
+        else:
+            self.events.append([MOVE, x, y])
+        self.trigger_flush()
+
+    def wheel(self, x, y, dx, dy):
+        self.received += 1
+        last = self.events[-1] if self.events else None
+        if last and last[0] == WHEEL:
+            last[1] = x
+            last[2] = y
+            last[3] += dx
+            last[4] += dy
+        else:
+            self.events.append([WHEEL, x, y, dx, dy])
+        self.trigger_flush()
+
+    def click(self, x, y, button, mouseUp, clickCount):
+        self.received += 1
+        self.flush()
+        browser = self.browser_widget.browser
+        if browser:
+            browser.SendMouseClickEvent(x, y, button, mouseUp=mouseUp, clickCount=clickCount)
+            self._sent(1)
+
+    def flush(self, *largs):
+        events = self.events
+        if not events:
+            return
+        self.events = []
+        browser = self.browser_widget.browser
+        if not browser:
+            return
+        for event in events:
+            if event[0] == MOVE:
+                browser.SendMouseMoveEvent(event[1], event[2], mouseLeave=False)
+            else:
+                browser.SendMouseWheelEvent(event[1], event[2], event[3], event[4])
+        self._sent(len(events))
+
+    def clear(self):
+        self.events = []
+
+    def _sent(self, count):
+        self.sent += count
+        if self.browser_widget.collect_stats:
+            self.browser_widget.render_stats.input_sent.add(count)
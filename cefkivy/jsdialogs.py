@@ -10,15 +10,27 @@ from kivy.factory import Factory
 
 import os
 
-#Add folder to the kivy resource path list
-#We are able than to just define relative paths regarding from the module directory.
-resources.resource_add_path(os.path.abspath(os.path.join(os.path.dirname(__file__))))
-Builder.load_file(resources.resource_find("jsdialogs.kv"))
+_kv_loaded = False
+
+
+def load_kv():
+    """
+    Loads the kv rules on first use instead of at import time.
+    """
+    global _kv_loaded
+    if _kv_loaded:
+        return
+    #Add folder to the kivy resource path list
+    #We are able than to just define relative paths regarding from the module directory.
+    resources.resource_add_path(os.path.abspath(os.path.join(os.path.dirname(__file__))))
+    Builder.load_file(resources.resource_find("jsdialogs.kv"))
+    _kv_loaded = True
 
 
 class JSDialogs(object):
 
     def __init__(self):
+        load_kv()
         # Create popups
         self.js_confirm = Factory.JSConfirm()
         self.js_alert = Factory.JSAlert()
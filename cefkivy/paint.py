@@ -0,0 +1,327 @@
+"""
+Paint helpers.
+CEF tells us in OnPaint which regions of the frame changed (dirty rects).
+Uploading only those regions keeps small animations like a blinking caret
+from costing a full frame copy and a full texture upload.
+CEF can paint several times during one Kivy frame, so OnPaint only copies
+the dirty regions into a FrameStage. The texture gets updated once per Kivy
+frame, right before drawing.
+"""
+import ctypes
+import threading
+
+from kivy.graphics.texture import Texture
+
+# If the dirty area covers more than this fraction of the frame, one full
+# upload is cheaper than several partial ones.
+FULL_UPLOAD_RATIO = 0.6
+# Dirty rects closer than this (in pixels) get merged into one upload.
+MERGE_DISTANCE = 16
+# More partial uploads than this and we upload the bounding box instead.
+MAX_RECTS = 8
+
+
+def merge_rects(rects, width, height, distance=MERGE_DISTANCE):
+    """
+    Clip the [x, y, width, height] rects given by CEF to the frame and merge
+    overlapping or close ones.
+    Returns a list of (x, y, width, height) tuples. If the dirty area is most
+    of the frame, a single rect covering the whole frame is returned.
+    """
+    boxes = []
+    for rect in rects:
+        x1 = max(0, int(rect[0]))
+        y1 = max(0, int(rect[1]))
+        x2 = min(width, int(rect[0] + rect[2]))
+        y2 = min(height, int(rect[1] + rect[3]))
+        if x2 > x1 and y2 > y1:
+            boxes.append([x1, y1, x2, y2])
+
+    # Merge until no two boxes are within distance of each other
+    merged = True
+    while merged and len(boxes) > 1:
+        merged = False
+        i = 0
+        while i < len(boxes):
+            a = boxes[i]
+            for j in range(len(boxes)-1, i, -1):
+                b = boxes[j]
+                if a[0]-distance <= b[2] and b[0]-distance <= a[2] \
+                        and a[1]-distance <= b[3] and b[1]-distance <= a[3]:
+                    a[0] = min(a[0], b[0])
+                    a[1] = min(a[1], b[1])
+                    a[2] = max(a[2], b[2])
+                    a[3] = max(a[3], b[3])
+                    del boxes[j]
+                    merged = True
+            i += 1
+
+    if len(boxes) > MAX_RECTS:
+        boxes = [[min(b[0] for b in boxes), min(b[1] for b in boxes),
+                  max(b[2] for b in boxes), max(b[3] for b in boxes)]]
+
+    area = sum((b[2]-b[0])*(b[3]-b[1]) for b in boxes)
+    if area >= FULL_UPLOAD_RATIO*width*height:
+        return [(0, 0, width, height)]
+    return [(b[0], b[1], b[2]-b[0], b[3]-b[1]) for b in boxes]
+
+
+class StagingBuffer(object):
+    """
+    Reusable memory used to pack the rows of a dirty rect into one contiguous
+    block before it gets uploaded. It only grows, so there are no per-frame
+    allocations once it reached the size of the largest rect.
+    """
+
+    def __init__(self):
+        self.data = bytearray(0)
+        self.address = 0
+        self._cdata = None
+
+    def reserve(self, size):
+        """
+        Returns the address of at least size bytes of staging memory.
+        """
+        if len(self.data) < size:
+            self.data = bytearray(size)
+            self._cdata = (ctypes.c_char*size).from_buffer(self.data)
+            self.address = ctypes.addressof(self._cdata)
+        return self.address
+
+    def view(self, size):
+        return memoryview(self.data)[:size]
+
+
+def frame_view(address, frame_width, frame_height):
+    """
+    Returns a memoryview on the BGRA pixels (top-left origin) CEF passes
+    to OnPaint. The memory belongs to CEF and is only valid during OnPaint.
+    """
+    size = frame_width*frame_height*4
+    return memoryview((ctypes.c_ubyte*size).from_address(address))
+
+
+def copy_rects(dst, src, rects, stride):
+    """
+    Copies the given rects from the frame at address src into the frame at
+    address dst. Both frames have the same size.
+    Returns the number of bytes copied.
+    """
+    copied = 0
+    for x, y, w, h in rects:
+        offset = y*stride+x*4
+        row = w*4
+        if row == stride:
+            ctypes.memmove(dst+offset, src+offset, row*h)
+        else:
+            for i in range(h):
+                ctypes.memmove(dst+offset+i*stride, src+offset+i*stride, row)
+        copied += row*h
+    return copied
+
+
+def blit_rects(texture, address, rects, frame_width, frame_height, staging):
+    """
+    Uploads the given rects of the CEF frame at address into texture. If
+    rects is None the whole frame gets uploaded straight from CEF's memory,
+    partial rects get packed into the staging buffer first.
+    Returns the number of bytes uploaded.
+    """
+    if rects is None:
+        rects = [(0, 0, frame_width, frame_height)]
+    stride = frame_width*4
+    uploaded = 0
+    for x, y, w, h in rects:
+        if w == frame_width and h == frame_height:
+            texture.blit_buffer(frame_view(address, frame_width, frame_height),
+                                colorfmt='bgra', bufferfmt='ubyte')
+            uploaded += stride*h
+            continue
+        row = w*4
+        size = row*h
+        offset = y*stride+x*4
+        if x == 0 and w == frame_width:
+            # Full rows are already contiguous in CEF's memory
+            view = frame_view(address, frame_width, frame_height)[offset:offset+size]
+        else:
+            dst = staging.reserve(size)
+            for i in range(h):
+                ctypes.memmove(dst+i*row, address+offset+i*stride, row)
+            view = staging.view(size)
+        texture.blit_buffer(view, size=(w, h), pos=(x, y),
+                            colorfmt='bgra', bufferfmt='ubyte')
+        uploaded += size
+    return uploaded
+
+
+class FrameStage(object):
+    """
+    Copy of the latest frame CEF painted for one texture together with the
+    union of the regions that changed since the last upload.
+    Paints and uploads run on the main thread, other threads reading the
+    frame copy (see snapshot.py) hold the lock meanwhile.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.width = 0
+        self.height = 0
+        self.frame = StagingBuffer()
+        self.dirty = []
+        self.full = True
+        self.pending = False
+        self.deferring = False
+        # Counters
+        self.painted = 0
+        self.uploaded = 0
+        self.skipped = 0  # Frames replaced by a newer one before upload
+        self.deferred = 0  # Frames that had to wait for a matching texture
+        self.dropped = 0  # Frames discarded without upload
+
+    def paint(self, address, dirty_rects, width, height):
+        """
+        Copies the dirty regions out of CEF's memory. Called from OnPaint.
+        Returns the number of bytes copied.
+        """
+        with self.lock:
+            if width != self.width or height != self.height:
+                self.width = width
+                self.height = height
+                self.full = True
+                self.dirty = []
+            if self.full:
+                rects = [(0, 0, width, height)]
+            else:
+                rects = merge_rects(dirty_rects, width, height)
+            copied = self.copy(self.frame.reserve(width*height*4), address, rects, width*4)
+            if self.pending:
+                self.skipped += 1
+            self.deferring = False
+            self.dirty.extend(rects)
+            if len(self.dirty) > MAX_RECTS:
+                self.dirty = merge_rects(self.dirty, width, height)
+            self.pending = True
+            self.painted += 1
+        return copied
+
+    def copy(self, dst, src, rects, stride):
+        return copy_rects(dst, src, rects, stride)
+
+    def invalidate(self):
+        """
+        Marks the whole frame for upload, e.g. after the texture got replaced.
+        """
+        if self.width and self.height:
+            self.full = True
+            self.pending = True
+
+    def upload(self, texture, staging, full=False):
+        """
+        Uploads the regions changed since the last upload into texture.
+        Returns the number of bytes uploaded (0 if nothing got uploaded).
+        """
+        if not self.pending:
+            return 0
+        if texture.width != self.width or texture.height != self.height:
+            # The texture doesn't match the frame (yet), e.g. a popup paint
+            # arrived before OnPopupSize. Keep the frame until it does.
+            if not self.deferring:
+                self.deferring = True
+                self.deferred += 1
+            return 0
+        rects = None
+        if not (full or self.full):
+            rects = merge_rects(self.dirty, self.width, self.height)
+        uploaded = blit_rects(texture, self.frame.address, rects, self.width, self.height, staging)
+        self.pending = False
+        self.deferring = False
+        self.full = False
+        self.dirty = []
+        self.uploaded += 1
+        return uploaded
+
+    def drop(self):
+        """
+        Discards the frame waiting for upload, e.g. when the popup got hidden.
+        """
+        if self.pending:
+            self.dropped += 1
+        self.pending = False
+        self.deferring = False
+        self.full = True
+        self.dirty = []
+
+    def release(self):
+        """
+        Frees the frame copy, e.g. while the browser is in the background.
+        The next paint starts over with a full frame.
+        """
+        self.drop()
+        with self.lock:
+            self.frame = StagingBuffer()
+            self.width = 0
+            self.height = 0
+
+    def counters(self):
+        return {"painted": self.painted,
+                "uploaded": self.uploaded,
+                "skipped": self.skipped,
+                "deferred": self.deferred,
+                "dropped": self.dropped,
+                }
+
+
+class TexturePool(object):
+    """
+    Reuses textures across size changes. Textures get allocated in size
+    buckets and a texture is kept as long as the new size fits into it and
+    it isn't much larger than needed, so an animated resize doesn't create a
+    new texture on every frame.
+    """
+    bucket = 128
+    # Area of a kept texture compared to the bucketed size it's used for
+    max_waste = 2.0
+    # Number of unused textures kept for later
+    max_free = 2
+
+    def __init__(self):
+        self.free = []
+        self.created = 0
+
+    def _bucket(self, value):
+        return max(self.bucket, -(-int(value)//self.bucket)*self.bucket)
+
+    def fits(self, texture, width, height):
+        return texture.width >= width and texture.height >= height and \
+            texture.width*texture.height <= self.max_waste*self._bucket(width)*self._bucket(height)
+
+    def get(self, width, height, current=None):
+        """
+        Returns a texture of at least width x height. current is the texture
+        used so far, it's kept if it still fits or handed back to the pool.
+        """
+        if current is not None:
+            if self.fits(current, width, height):
+                return current
+            self.release(current)
+        for texture in self.free:
+            if self.fits(texture, width, height):
+                self.free.remove(texture)
+                return texture
+        self.created += 1
+        return Texture.create(size=(self._bucket(width), self._bucket(height)),
+                              colorfmt='rgba', bufferfmt='ubyte')
+
+    def release(self, texture):
+        self.free.insert(0, texture)
+        del self.free[self.max_free:]
+
+
+def texture_region(texture, width, height):
+    """
+    Returns the width x height region of a pooled texture, flipped since CEF
+    paints with a top-left origin.
+    """
+    region = texture.get_region(0, 0, max(1, int(width)), max(1, int(height)))
+    region.flip_vertical()
+    return region
@@ -0,0 +1,139 @@
+"""
+Parallel paint staging.
+At 4K a full frame is 33 MB, copying it out of CEF's memory in OnPaint
+blocks the main thread (and with it touch handling) for several ms per
+frame. ThreadedFrameStage splits large copies into bands of rows and copies
+them on several threads at once, memmove releases the GIL.
+This deliberately doesn't hand the copy off to a worker and return from
+OnPaint right away (double buffering the frame): CEF's paint buffer is only
+valid during OnPaint, so the copy has to be finished before it returns. The
+main thread copies one band itself and waits for the workers, OnPaint gets
+shorter but still ends with the frame copied.
+The workers are shared by all browsers (see copy_pool), they sit idle
+between large frames.
+"""
+import multiprocessing
+import threading
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from paint import FrameStage, copy_rects
+
+
+def split_rects(rects, parts):
+    """
+    Splits rects into at most parts lists of row bands with about the same
+    number of pixels each.
+    """
+    share = max(1, -(-sum(w*h for x, y, w, h in rects)//parts))
+    bands = [[]]
+    left = share
+    for x, y, w, h in rects:
+        while h > 0:
+            rows = min(h, max(1, left//w))
+            bands[-1].append((x, y, w, rows))
+            y += rows
+            h -= rows
+            left -= rows*w
+            if left <= 0 and len(bands) < parts:
+                bands.append([])
+                left = share
+    return [band for band in bands if band]
+
+
+class CopyPool(object):
+    """
+    Worker threads copying bands of rows, shared by all ThreadedFrameStages
+    with the same number of threads. Only used from the main thread (OnPaint),
+    so one copy at a time.
+    """
+
+    def __init__(self, threads):
+        self.jobs = Queue()
+        self.results = Queue()  # True per copied band, False if it failed
+        self.workers = []
+        for i in range(threads-1):
+            thread = threading.Thread(target=self._run, name="cefkivy-paint")
+            thread.daemon = True
+            thread.start()
+            self.workers.append(thread)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                copy_rects(*job)
+            except Exception as e:
+                print("Paint copy failed: %s" % e)
+                self.results.put(False)
+            else:
+                self.results.put(True)
+
+
+_pools = {}  # Threads -> CopyPool
+
+
+def copy_pool(threads):
+    """
+    Returns the shared CopyPool for threads, started with the first copy.
+    """
+    if threads not in _pools:
+        _pools[threads] = CopyPool(threads)
+    return _pools[threads]
+
+
+class ThreadedFrameStage(FrameStage):
+    # Copies smaller than this (bytes) are done by the main thread alone,
+    # handing them over costs more than the copy.
+    min_size = 4*1024*1024
+
+    def __init__(self, threads=None):
+        """
+        :param threads: Threads copying a frame, the main thread included.
+                        Defaults to the number of CPUs, at most 4.
+        """
+        super(ThreadedFrameStage, self).__init__()
+        if threads is None:
+            threads = min(4, multiprocessing.cpu_count())
+        self.threads = max(1, threads)
+        self.failed = False
+        # Counters
+        self.copied_parallel = 0  # Frames copied by more than one thread
+        self.copy_failures = 0
+
+    def paint(self, address, dirty_rects, width, height):
+        copied = super(ThreadedFrameStage, self).paint(address, dirty_rects, width, height)
+        if self.failed:
+            # Parts of the frame copy are broken: don't upload it, dropping
+            # makes the next paint copy (and upload) the whole frame again.
+            self.failed = False
+            self.copy_failures += 1
+            self.drop()
+        return copied
+
+    def copy(self, dst, src, rects, stride):
+        size = sum(w*h*4 for x, y, w, h in rects)
+        if size < self.min_size or self.threads < 2:
+            return copy_rects(dst, src, rects, stride)
+        pool = copy_pool(self.threads)
+        bands = split_rects(rects, self.threads)
+        for band in bands[1:]:
+            pool.jobs.put((dst, src, band, stride))
+        try:
+            copy_rects(dst, src, bands[0], stride)
+        finally:
+            # CEF may free or reuse its buffer once OnPaint returns
+            for band in bands[1:]:
+                if not pool.results.get():
+                    self.failed = True
+        self.copied_parallel += 1
+        return size
+
+    def counters(self):
+        counters = super(ThreadedFrameStage, self).counters()
+        counters["copied_parallel"] = self.copied_parallel
+        counters["copy_failures"] = self.copy_failures
+        return counters
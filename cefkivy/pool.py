@@ -0,0 +1,101 @@
+"""
+Browser pool.
+Creating a browser starts a new renderer, which is what users wait for when
+a page opens a popup. The pool keeps a number of hidden, pre-created browsers
+(JS bindings already attached) around, hands them out on acquire() and
+refills itself in the background.
+"""
+from collections import deque
+
+from kivy.clock import Clock
+
+
+class BrowserPool(object):
+    # Delay between the creation of two browsers when refilling, so the
+    # refill doesn't block several frames in a row.
+    refill_delay = 0.5
+    # Number of first paint times kept for stats()
+    history = 50
+
+    def __init__(self, factory, size=1, **browser_kwargs):
+        """
+        :param factory: Callable creating a browser widget, e.g. PopupBrowser
+        :param size: Number of warm browsers kept in the pool
+        :param browser_kwargs: Passed to factory
+        """
+        self.factory = factory
+        self.size = size
+        self.browser_kwargs = browser_kwargs
+        self.browsers = []
+        self.first_paint_times = deque(maxlen=self.history)
+        self.hits = 0
+        self.misses = 0
+        self.refill()
+
+    def _create(self):
+        kwargs = dict(self.browser_kwargs)
+        kwargs.setdefault("url", "about:blank")
+        browser = self.factory(**kwargs)
+        browser.bind(on_first_paint=self._on_first_paint)
+        return browser
+
+    def _on_first_paint(self, browser, duration):
+        self.first_paint_times.append(duration)
+
+    def acquire(self):
+        """
+        Returns a warm browser, or a new one if the pool is empty.
+        """
+        if self.browsers:
+            self.hits += 1
+            browser = self.browsers.pop(0)
+        else:
+            self.misses += 1
+            browser = self._create()
+        self.refill()
+        return browser
+
+    def release(self, browser):
+        """
+        Gives a browser back. It's kept if the pool isn't full, otherwise
+        it gets closed.
+        """
+        if browser.parent:
+            browser.parent.remove_widget(browser)
+        if len(self.browsers) < self.size:
+            browser.url = "about:blank"
+            self.browsers.append(browser)
+        else:
+            browser.unbind(on_first_paint=self._on_first_paint)
+            browser.close()
+
+    def refill(self, *largs):
+        Clock.unschedule(self._refill_one)
+        if len(self.browsers) < self.size:
+            Clock.schedule_once(self._refill_one, self.refill_delay)
+
+    def _refill_one(self, *largs):
+        if len(self.browsers) < self.size:
+            self.browsers.append(self._create())
+        self.refill()
+
+    def clear(self):
+        Clock.unschedule(self._refill_one)
+        for browser in self.browsers:
+            browser.close()
+        self.browsers = []
+
+    def stats(self):
+        """
+        Returns hit/miss counters and the time-to-first-paint (seconds) of
+        the browsers handed out by this pool.
+        """
+        times = sorted(self.first_paint_times)
+        return {"size": self.size,
+                "warm": len(self.browsers),
+                "hits": self.hits,
+                "misses": self.misses,
+                "first_paint_last": self.first_paint_times[-1] if times else None,
+                "first_paint_median": times[len(times)//2] if times else None,
+                "first_paint_max": times[-1] if times else None,
+                }
@@ -12,15 +12,26 @@ from kivy.core.window import Window
 from browser import CefBrowser
 from browser import cefpython
 from jsdialogs import JSDialogs
+from pool import BrowserPool
 
 import os
 
-#Add folder to the kivy resource path list
-#We are able than to just define relative paths regarding from the module directory.
-resources.resource_add_path(os.path.abspath(os.path.join(os.path.dirname(__file__))))
-Builder.load_file(resources.resource_find("popup.kv"))
-
 RESOURCE_DIR = ""
+_kv_loaded = False
+
+
+def load_kv():
+    """
+    Loads the kv rules on first use instead of at import time.
+    """
+    global _kv_loaded
+    if _kv_loaded:
+        return
+    #Add folder to the kivy resource path list
+    #We are able than to just define relative paths regarding from the module directory.
+    resources.resource_add_path(os.path.abspath(os.path.join(os.path.dirname(__file__))))
+    Builder.load_file(resources.resource_find("popup.kv"))
+    _kv_loaded = True
 
 
 class PopupBrowser(CefBrowser):
@@ -31,6 +42,7 @@ class PopupBrowser(CefBrowser):
     def on_touch_down(self, touch, *kwargs):
         if not self.collide_point(*touch.pos):
             return
+        self.input_activity()
         if self.keyboard_mode == "global":
             self.request_keyboard()
         else:
@@ -45,7 +57,7 @@ class PopupBrowser(CefBrowser):
             # Only mouse click when single touch
             y = self.height-touch.pos[1] + self.pos[1]
             x = touch.x - self.pos[0]
-            self.browser.SendMouseClickEvent(
+            self.input_queue.click(
                 x,
                 y,
                 cefpython.MOUSEBUTTON_LEFT,
@@ -57,27 +69,29 @@ class PopupBrowser(CefBrowser):
     def on_touch_move(self, touch, *kwargs):
         if touch.grab_current is not self:
             return
+        self.input_activity()
 
         if len(self.touches) == 1:
             # Moving
             if (abs(touch.dx) > 5 or abs(touch.dy) > 5) or touch.moving:
                 y = self.height-touch.pos[1] + self.pos[1]
                 x = touch.x - self.pos[0]
-                self.browser.SendMouseMoveEvent(x, y, mouseLeave=False)
+                self.input_queue.move(x, y)
         else:
             # Scrolling
             touch1, touch2 = self.touches[:2]
             dx = touch2.dx / 2. + touch1.dx / 2.
             dy = touch2.dy / 2. + touch1.dy / 2.
-            self.browser.SendMouseWheelEvent(touch.x, self.height-touch.pos[1], dx, -dy)
+            self.input_queue.wheel(touch.x, self.height-touch.pos[1], dx, -dy)
         return True
 
     def on_touch_up(self, touch, *kwargs):
         if touch.grab_current is not self:
             return
+        self.input_activity()
         y = self.height-touch.pos[1] + self.pos[1]
         x = touch.x - self.pos[0]
-        self.browser.SendMouseClickEvent(
+        self.input_queue.click(
             x,
             y,
             cefpython.MOUSEBUTTON_LEFT,
@@ -90,24 +104,44 @@ class PopupBrowser(CefBrowser):
 
 class PopupController(object):
 
-    def __init__(self, resource_dir=None):
+    def __init__(self, resource_dir=None, pool_size=1):
+        """
+        :param pool_size: Number of pre-created browsers kept warm for popups
+        """
         # Define data path
         if resource_dir:
             global RESOURCE_DIR
             RESOURCE_DIR = resource_dir
 
         # Create popup
+        load_kv()
         self.popup = Factory.CEFPopup()
         self.popup.bind(on_dismiss=self.on_close_popup)
         self.jsdialogs = JSDialogs()
-        self.popup.browser.bind(on_js_dialog=self.jsdialogs.on_js_dialog)
-        self.popup.browser.bind(on_before_unload_dialog=self.jsdialogs.on_before_unload_dialog)
+        self.pool = BrowserPool(PopupBrowser, size=pool_size)
 
     def on_before_popup(self, obj, browser, frame, targetUrl, targetFrameName,
                         popupFeatures, windowInfo, client, browserSettings, noJavascriptAccess):
         print windowInfo, popupFeatures, targetFrameName
+        if self.popup.browser:
+            self.release_browser()
+        browser = self.pool.acquire()
+        browser.bind(on_js_dialog=self.jsdialogs.on_js_dialog)
+        browser.bind(on_before_unload_dialog=self.jsdialogs.on_before_unload_dialog)
+        self.popup.container.add_widget(browser)
+        self.popup.browser = browser
         self.popup.url = targetUrl
+        browser.url = targetUrl
         self.popup.open()
 
     def on_close_popup(self, *kwargs):
-        self.popup.url = "about:blank"
\ No newline at end of file
+        self.popup.url = "about:blank"
+        if self.popup.browser:
+            self.release_browser()
+
+    def release_browser(self):
+        browser = self.popup.browser
+        self.popup.browser = None
+        browser.unbind(on_js_dialog=self.jsdialogs.on_js_dialog)
+        browser.unbind(on_before_unload_dialog=self.jsdialogs.on_before_unload_dialog)
+        self.pool.release(browser)
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Page preloading.
+Kiosk flows are predictable, so the likely next pages can be loaded ahead in
+hidden browsers. When a CefBrowser with a preloader navigates to a preloaded
+URL, it swaps in the browser holding the loaded page (see
+CefBrowser.swap_browser()) instead of loading it, and the page it showed
+before is kept as preloaded page in turn.
+Each hidden browser costs a renderer process, the preloader keeps them under
+memory_budget and closes the least recently used ones first.
+"""
+from collections import OrderedDict
+
+from kivy.clock import Clock
+
+
+class Preloader(object):
+    # Delay between the creation of two browsers, so preloading a list of
+    # URLs doesn't block several frames in a row.
+    load_delay = 0.5
+    # Estimated memory of one browser besides its view buffers (renderer
+    # process, JS heap, ...). There is no way to ask CEF, adjust it to what
+    # the pages need.
+    renderer_memory = 50*1024*1024
+
+    def __init__(self, factory, memory_budget=256*1024*1024, size=(1280, 720), **browser_kwargs):
+        """
+        :param factory: Callable creating a browser widget, e.g. CefBrowser
+        :param memory_budget: Estimated memory (bytes) of all preloaded pages
+        :param size: Size the pages get laid out at, use the size of the
+                     browser widget showing them later
+        :param browser_kwargs: Passed to factory
+        """
+        self.factory = factory
+        self.memory_budget = memory_budget
+        self.size = size
+        self.browser_kwargs = browser_kwargs
+        self.entries = OrderedDict()  # url -> browser widget, least recently used first
+        self.queue = []
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def preload(self, urls):
+        """
+        Loads the URLs in hidden browsers (one every load_delay seconds).
+        URLs preloaded already count as recently used again.
+        """
+        for url in urls:
+            if url in self.entries:
+                self.entries[url] = self.entries.pop(url)
+            elif url not in self.queue:
+                self.queue.append(url)
+        Clock.unschedule(self._load_next)
+        if self.queue:
+            Clock.schedule_once(self._load_next, 0)
+
+    def _load_next(self, *largs):
+        if not self.queue:
+            return
+        url = self.queue.pop(0)
+        if url not in self.entries:
+            browser = self.factory(url=url, **self.browser_kwargs)
+            browser.size = self.size
+            self.put(url, browser)
+        if self.queue:
+            Clock.schedule_once(self._load_next, self.load_delay)
+
+    def put(self, url, browser):
+        """
+        Keeps browser as preloaded page of url.
+        """
+        if not url or url == "about:blank":
+            browser.close()
+            return
+        old = self.entries.pop(url, None)
+        if old is not None and old is not browser:
+            old.close()
+        if browser.parent:
+            browser.parent.remove_widget(browser)
+        self.entries[url] = browser
+        self.evict()
+
+    def take(self, url):
+        """
+        Returns the browser holding the preloaded page of url (which is no
+        longer kept by the preloader), None if it isn't preloaded.
+        """
+        browser = self.entries.pop(url, None)
+        if browser is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return browser
+
+    def estimate(self, browser):
+        # The widget size, CEF gets told about it (view_size) only after
+        # the resize delay
+        width, height = int(browser.width), int(browser.height)
+        # CEF's backing store, the staging copy and the texture
+        return self.renderer_memory+3*4*width*height
+
+    def memory(self):
+        return sum(self.estimate(browser) for browser in self.entries.values())
+
+    def evict(self):
+        while self.entries and self.memory() > self.memory_budget:
+            url, browser = self.entries.popitem(last=False)
+            browser.close()
+            self.evictions += 1
+
+    def clear(self):
+        Clock.unschedule(self._load_next)
+        self.queue = []
+        for browser in self.entries.values():
+            browser.close()
+        self.entries.clear()
+
+    def stats(self):
+        return {"preloaded": list(self.entries),
+                "queued": list(self.queue),
+                "memory": self.memory(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                }
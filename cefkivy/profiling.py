@@ -0,0 +1,123 @@
+"""
+Callback profiling.
+All traffic from CEF to Python goes through the ClientHandler. The profiler
+wraps its callbacks (and the dispatch() of the browser widget, so the on_*
+event handlers are included) and records call counts, cumulative and max
+time and the threads they ran on. Nested calls, like a dispatch() inside
+OnLoadStart, are kept as stacks, which can be written in the folded format
+flame graph tools read.
+"""
+import json
+import threading
+import time
+from functools import wraps
+
+
+class CallbackProfiler(object):
+
+    def __init__(self):
+        self.stats = {}
+        self.stacks = {}
+        self._local = threading.local()
+        self._wrapped = []
+
+    def wrap(self, obj, prefix, names=None):
+        """
+        Wraps the given methods of obj (by default all public methods
+        starting with an upper case letter, i.e. the CEF callbacks).
+        """
+        if names is None:
+            names = [name for name in dir(obj) if name[:1].isupper()
+                     and callable(getattr(obj, name))]
+        for name in names:
+            method = getattr(obj, name)
+            setattr(obj, name, self._wrap_callable(method, "%s.%s" % (prefix, name)))
+            self._wrapped.append((obj, name))
+
+    def wrap_dispatch(self, widget):
+        """
+        Wraps widget.dispatch(), events are recorded as dispatch:<event>.
+        """
+        dispatch = widget.dispatch
+        record = self.record
+
+        @wraps(dispatch)
+        def profiled_dispatch(event_type, *largs, **kwargs):
+            return record("dispatch:%s" % event_type, dispatch, event_type, *largs, **kwargs)
+        widget.dispatch = profiled_dispatch
+        self._wrapped.append((widget, "dispatch"))
+
+    def restore(self):
+        """
+        Removes all wrappers again.
+        """
+        for obj, name in self._wrapped:
+            try:
+                delattr(obj, name)
+            except AttributeError:
+                pass
+        self._wrapped = []
+
+    def _wrap_callable(self, func, name):
+        record = self.record
+
+        @wraps(func)
+        def profiled(*largs, **kwargs):
+            return record(name, func, *largs, **kwargs)
+        return profiled
+
+    def record(self, name, func, *largs, **kwargs):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        # [name, time spent in nested calls]
+        stack.append([name, 0])
+        start = time.time()
+        try:
+            return func(*largs, **kwargs)
+        finally:
+            duration = time.time()-start
+            children = stack.pop()[1]
+            if stack:
+                stack[-1][1] += duration
+            thread = threading.current_thread().name
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {"calls": 0, "total": 0., "max": 0., "threads": {}}
+            stat["calls"] += 1
+            stat["total"] += duration
+            stat["max"] = max(stat["max"], duration)
+            stat["threads"][thread] = stat["threads"].get(thread, 0)+1
+            path = ";".join([thread]+[frame[0] for frame in stack]+[name])
+            self.stacks[path] = self.stacks.get(path, 0)+duration-children
+
+    def reset(self):
+        self.stats = {}
+        self.stacks = {}
+
+    def results(self):
+        """
+        Returns name -> calls, total and max time (seconds), calls per thread.
+        """
+        return dict((name, dict(stat, threads=dict(stat["threads"])))
+                    for name, stat in self.stats.items())
+
+    def dump_json(self, path=None):
+        data = json.dumps(self.results(), indent=2, sort_keys=True)
+        if path:
+            with open(path, "w") as f:
+                f.write(data)
+        return data
+
+    def dump_folded(self, path=None):
+        """
+        One "thread;outer;inner <microseconds>" line per stack, as read by
+        flamegraph.pl or speedscope.
+        """
+        lines = ["%s %d" % (stack, round(duration*1000000))
+                 for stack, duration in sorted(self.stacks.items())]
+        data = "\n".join(lines)+"\n"
+        if path:
+            with open(path, "w") as f:
+                f.write(data)
+        return data
@@ -0,0 +1,127 @@
+"""
+CEF message pump.
+CEF needs cefpython.MessageLoopWork() to be called regularly. Calling it on
+every Kivy frame keeps a core busy even when the page is static, so the pump
+backs off when CEF has nothing to do and speeds up again on activity
+(paints, loading, input). cefpython doesn't expose CEF's
+OnScheduleMessagePumpWork, so there are no scheduling hints from CEF, the
+activity has to be reported by the browser widgets.
+"""
+import time
+
+from kivy.clock import Clock
+
+from stats import RollingHistogram
+
+
+class MessagePump(object):
+    # Interval used while CEF is busy (0 = every Kivy frame)
+    min_interval = 0
+    # Interval the pump backs off to while CEF is idle (seconds)
+    max_interval = 0.2
+    # Factor the interval grows with per idle tick
+    backoff = 1.5
+    # First interval used when backing off from min_interval = 0
+    backoff_start = 1/60.
+
+    def __init__(self, cefpython, min_interval=None, max_interval=None):
+        self.cefpython = cefpython
+        if min_interval is not None:
+            self.min_interval = min_interval
+        if max_interval is not None:
+            self.max_interval = max_interval
+        self.interval = self.min_interval
+        self.running = False
+        self._activity = False
+        self._busy = set()
+        self._next = 0
+        # Statistics
+        self.ticks = 0
+        self.idle_ticks = 0
+        self.work_time = 0
+        self.max_work_time = 0
+        self.work_times = RollingHistogram()
+        self._started = 0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._started = time.time()
+        self._schedule(self.min_interval)
+
+    def stop(self):
+        self.running = False
+        Clock.unschedule(self._tick)
+
+    def set_intervals(self, min_interval=None, max_interval=None):
+        """
+        Changes the intervals (None keeps one) for all browsers.
+        """
+        if min_interval is None and max_interval is None:
+            return
+        if min_interval is not None:
+            self.min_interval = min_interval
+        if max_interval is not None:
+            self.max_interval = max_interval
+        self.notify_activity()
+
+    def notify_activity(self):
+        """
+        Tells the pump that CEF has work (paint, input, ...), the next tick
+        runs after min_interval.
+        """
+        self._activity = True
+        self.interval = self.min_interval
+        if self.running and self._next-time.time() > self.min_interval:
+            self._schedule(self.min_interval)
+
+    def set_busy(self, owner, busy):
+        """
+        Keeps the pump at min_interval as long as any owner is busy
+        (e.g. a browser loading a page).
+        """
+        if busy:
+            self._busy.add(owner)
+            self.notify_activity()
+        else:
+            self._busy.discard(owner)
+
+    def stats(self):
+        """
+        Returns the pump statistics as dict.
+        """
+        elapsed = time.time()-self._started if self._started else 0
+        return {"ticks": self.ticks,
+                "idle_ticks": self.idle_ticks,
+                "interval": self.interval,
+                "ticks_per_second": self.ticks/elapsed if elapsed else 0,
+                "work_time": self.work_time,
+                "avg_work_time": self.work_time/self.ticks if self.ticks else 0,
+                "max_work_time": self.max_work_time,
+                }
+
+    def _schedule(self, delay):
+        Clock.unschedule(self._tick)
+        self._next = time.time()+delay
+        Clock.schedule_once(self._tick, delay)
+
+    def _tick(self, *largs):
+        if not self.running:
+            return
+        start = time.time()
+        self.cefpython.MessageLoopWork()
+        duration = time.time()-start
+        self.ticks += 1
+        self.work_time += duration
+        self.max_work_time = max(self.max_work_time, duration)
+        self.work_times.add(duration)
+
+        if self._activity or self._busy:
+            self.interval = self.min_interval
+        else:
+            self.idle_ticks += 1
+            self.interval = min(self.max_interval,
+                                max(self.interval*self.backoff, self.backoff_start))
+        self._activity = False
+        self._schedule(self.interval)
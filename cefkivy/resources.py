@@ -0,0 +1,366 @@
+"""
+Local resource cache.
+Serves requests through ClientHandler.GetResourceHandler() instead of the
+network:
+- mount(prefix, directory): URLs starting with prefix come from the files
+  in directory, e.g. the start pages of a kiosk.
+- cache(prefix): URLs starting with prefix get fetched once and kept in an
+  in-memory LRU (max_size bytes), e.g. shared JS/CSS bundles. Entries older
+  than max_age get fetched again, but are still served while the network is
+  down.
+Bodies are streamed in chunks, large files and downloads are never held in
+memory as a whole: a fetch reads at most read_ahead bytes ahead of CEF. Only GET requests are served, fetched resources are
+requested without cookies, so use it for static assets.
+All ResourceCache and handler methods except the configuration run on CEF's
+IO thread.
+"""
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+try:
+    from urllib import unquote
+    from urllib2 import HTTPError, Request, urlopen
+except ImportError:
+    from urllib.error import HTTPError
+    from urllib.parse import unquote
+    from urllib.request import Request, urlopen
+
+
+class ResourceCache(object):
+    chunk_size = 64*1024
+    # Bytes a fetch may read ahead of CEF, it waits for CEF to catch up
+    read_ahead = 1024*1024
+    # Timeout of fetches in seconds
+    timeout = 10
+
+    def __init__(self, max_size=32*1024*1024, max_entry_size=4*1024*1024, max_age=None):
+        """
+        :param max_size: Size of the in-memory LRU in bytes
+        :param max_entry_size: Larger responses are streamed but not cached
+        :param max_age: Seconds after which cached entries get fetched again
+        """
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+        self.max_age = max_age
+        self.mounts = []
+        self.cached_prefixes = []
+        self.entries = OrderedDict()  # url -> (time, status, mime type, body)
+        self.size = 0
+        self.lock = threading.Lock()
+        # cefpython only keeps weak references to resource handlers
+        self.handlers = set()
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0  # Served from the LRU because the fetch failed
+        self.errors = 0
+        self.evictions = 0
+        self.bytes_served = 0
+
+    def mount(self, prefix, directory):
+        """
+        Serves URLs starting with prefix from the files in directory, the
+        rest of the URL is the path relative to directory.
+        """
+        self.mounts.append((prefix, os.path.abspath(directory)))
+
+    def cache(self, prefix):
+        """
+        Keeps the responses of URLs starting with prefix in memory.
+        """
+        self.cached_prefixes.append(prefix)
+
+    def find_file(self, url):
+        for prefix, directory in self.mounts:
+            if not url.startswith(prefix):
+                continue
+            relative = unquote(url[len(prefix):].split("?", 1)[0].split("#", 1)[0]).lstrip("/")
+            path = os.path.normpath(os.path.join(directory, relative or "index.html"))
+            # No ".." out of the mounted directory (nor into a sibling
+            # directory starting with the same name)
+            if path.startswith(os.path.join(directory, "")) and os.path.isfile(path):
+                return path
+        return None
+
+    def is_cached(self, url):
+        for prefix in self.cached_prefixes:
+            if url.startswith(prefix):
+                return True
+        return False
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                # Most recently used last
+                del self.entries[url]
+                self.entries[url] = entry
+            return entry
+
+    def put(self, url, status, mime_type, body):
+        if len(body) > self.max_entry_size:
+            return
+        with self.lock:
+            old = self.entries.pop(url, None)
+            if old is not None:
+                self.size -= len(old[3])
+            self.entries[url] = (time.time(), status, mime_type, body)
+            self.size += len(body)
+            while self.size > self.max_size:
+                evicted_url, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[3])
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_handler(self, request):
+        """
+        Returns a handler serving the request, None lets CEF load it.
+        """
+        if request.GetMethod() not in ("GET", ""):
+            return None
+        url = request.GetUrl()
+        handler = None
+        path = self.find_file(url)
+        if path:
+            self.hits += 1
+            handler = FileHandler(self, url, path)
+        elif self.is_cached(url):
+            entry = self.get(url)
+            if entry is not None and (not self.max_age or time.time()-entry[0] < self.max_age):
+                self.hits += 1
+                handler = MemoryHandler(self, url, entry)
+            else:
+                self.misses += 1
+                handler = FetchHandler(self, url, stale=entry)
+        if handler:
+            self.handlers.add(handler)
+        return handler
+
+    def stats(self):
+        with self.lock:
+            entries = len(self.entries)
+            size = self.size
+        requests = self.hits+self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits/float(requests) if requests else 0,
+                "stale_hits": self.stale_hits,
+                "errors": self.errors,
+                "evictions": self.evictions,
+                "bytes_served": self.bytes_served,
+                "entries": entries,
+                "size": size,
+                }
+
+
+class ResourceHandler(object):
+    """
+    Serves one request from self.stream, see cefpython's ResourceHandler.
+    """
+    status = 200
+    status_text = "OK"
+    mime_type = "application/octet-stream"
+    length = -1  # Unknown
+    stream = None
+
+    def __init__(self, cache, url):
+        self.cache = cache
+        self.url = url
+
+    def open(self):
+        pass
+
+    def ProcessRequest(self, request, callback):
+        self.open()
+        callback.Continue()
+        return True
+
+    def GetResponseHeaders(self, response, responseLengthOut, redirectUrlOut):
+        response.SetStatus(self.status)
+        response.SetStatusText(self.status_text)
+        response.SetMimeType(self.mime_type)
+        responseLengthOut[0] = self.length
+
+    def ReadResponse(self, dataOut, bytesToRead, bytesReadOut, callback):
+        data = self.stream.read(bytesToRead) if self.stream else b""
+        if not data:
+            self.close()
+            return False
+        dataOut[0] = data
+        bytesReadOut[0] = len(data)
+        self.cache.bytes_served += len(data)
+        return True
+
+    def CanGetCookie(self, cookie):
+        return True
+
+    def CanSetCookie(self, cookie):
+        return True
+
+    def Cancel(self):
+        self.close()
+
+    def close(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self.cache.handlers.discard(self)
+
+
+class FileHandler(ResourceHandler):
+
+    def __init__(self, cache, url, path):
+        super(FileHandler, self).__init__(cache, url)
+        self.path = path
+
+    def open(self):
+        try:
+            self.stream = open(self.path, "rb")
+            self.length = os.path.getsize(self.path)
+        except (IOError, OSError):
+            self.cache.errors += 1
+            self.status, self.status_text, self.length = 404, "Not Found", 0
+            return
+        self.mime_type = mimetypes.guess_type(self.path)[0] or self.mime_type
+
+
+class MemoryHandler(ResourceHandler):
+
+    def __init__(self, cache, url, entry):
+        super(MemoryHandler, self).__init__(cache, url)
+        self.entry = entry
+
+    def open(self):
+        created, self.status, self.mime_type, body = self.entry
+        self.stream = BytesIO(body)
+        self.length = len(body)
+
+
+class FetchHandler(ResourceHandler):
+    """
+    Fetches the URL on a thread of its own. Chunks are passed on to CEF as
+    they arrive and kept for the LRU until max_entry_size is exceeded.
+    """
+
+    def __init__(self, cache, url, stale=None):
+        super(FetchHandler, self).__init__(cache, url)
+        self.stale = stale
+        self.chunks = []
+        self.buffered = 0  # Bytes in chunks
+        self.finished = False
+        self.cancelled = False
+        self.read_callback = None
+        # Reentrant, ReadResponse() closes the handler holding it
+        self.lock = threading.RLock()
+        # Signalled when CEF read from chunks (or the request got cancelled)
+        self.space = threading.Condition(self.lock)
+
+    def ProcessRequest(self, request, callback):
+        thread = threading.Thread(target=self._fetch, args=(callback,), name="cefkivy-fetch")
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _fetch(self, headers_callback):
+        cache = self.cache
+        try:
+            try:
+                response = urlopen(Request(self.url), timeout=cache.timeout)
+            except HTTPError as e:
+                # Error pages get passed on (and not cached)
+                response = e
+            self.status = response.getcode() or 200
+            info = response.info()
+            self.mime_type = (info.get("Content-Type") or self.mime_type).split(";")[0]
+            length = info.get("Content-Length")
+            self.length = int(length) if length else -1
+        except Exception:
+            if self.stale is None:
+                cache.errors += 1
+                self.status, self.status_text, self.length = 502, "Bad Gateway", 0
+                self.finished = True
+            else:
+                # Network down, serve what we have
+                cache.stale_hits += 1
+                created, self.status, self.mime_type, body = self.stale
+                self.length = len(body)
+                self.chunks.append(body)
+                self.buffered += len(body)
+                self.finished = True
+            headers_callback.Continue()
+            return
+        headers_callback.Continue()
+
+        body = []
+        body_size = 0
+        try:
+            while not self.cancelled:
+                chunk = response.read(cache.chunk_size)
+                if not chunk:
+                    break
+                if body is not None:
+                    body.append(chunk)
+                    body_size += len(chunk)
+                    if body_size > cache.max_entry_size:
+                        body = None  # Streamed only
+                self._push(chunk)
+        except Exception:
+            cache.errors += 1
+            body = None
+        finally:
+            response.close()
+        # Cached before the end of the response, so requests made once it
+        # is loaded find it
+        if body is not None and not self.cancelled and 200 <= self.status < 300:
+            cache.put(self.url, self.status, self.mime_type, b"".join(body))
+        self._push(b"")
+
+    def _push(self, chunk):
+        with self.lock:
+            while chunk and self.buffered >= self.cache.read_ahead and not self.cancelled:
+                self.space.wait()
+            if chunk:
+                self.chunks.append(chunk)
+                self.buffered += len(chunk)
+            else:
+                self.finished = True
+            callback, self.read_callback = self.read_callback, None
+        if callback:
+            callback.Continue()
+
+    def ReadResponse(self, dataOut, bytesToRead, bytesReadOut, callback):
+        with self.lock:
+            if not self.chunks:
+                if self.finished:
+                    self.close()
+                    return False
+                # CEF reads again after callback.Continue()
+                self.read_callback = callback
+                bytesReadOut[0] = 0
+                return True
+            chunk = self.chunks[0]
+            if len(chunk) > bytesToRead:
+                self.chunks[0] = chunk[bytesToRead:]
+                chunk = chunk[:bytesToRead]
+            else:
+                self.chunks.pop(0)
+            self.buffered -= len(chunk)
+            self.space.notify()
+        dataOut[0] = chunk
+        bytesReadOut[0] = len(chunk)
+        self.cache.bytes_served += len(chunk)
+        return True
+
+    def close(self):
+        with self.lock:
+            self.cancelled = True
+            self.space.notify()
+        super(FetchHandler, self).close()
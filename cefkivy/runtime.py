@@ -0,0 +1,189 @@
+"""
+CEF runtime.
+CEF can only be initialized once per process and its message loop is global,
+so all CefBrowser widgets share one CefRuntime. It initializes CEF on first
+use, runs a single message pump for all browsers and keeps track of the
+live browsers.
+Loading libcef.so and cefpython is slow, so it's deferred until a browser
+gets created or warm_up() is called. Call load_cefpython() early yourself if
+cefpython has to be imported before other modules.
+"""
+import ctypes
+import os
+import sys
+import time
+
+from kivy.clock import Clock
+
+from cookies import CookieStore
+from pump import MessagePump
+
+_cefpython = None
+# Durations of the startup steps in seconds, see CefRuntime.startup_timings()
+timings = {}
+
+
+def load_cefpython():
+    """
+    Imports cefpython (once) and returns the module.
+    """
+    global _cefpython
+    if _cefpython is not None:
+        return _cefpython
+    start = time.time()
+    libcef_so = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libcef.so')
+    if os.path.exists(libcef_so):
+        # Import local module
+        ctypes.CDLL(libcef_so, ctypes.RTLD_GLOBAL)
+        if 0x02070000 <= sys.hexversion < 0x03000000:
+            import cefpython_py27 as cefpython
+        else:
+            raise Exception("Unsupported python version: %s" % sys.version)
+    else:
+        # Import from package
+        from cefpython3 import cefpython
+    _cefpython = cefpython
+    timings["cefpython_import"] = time.time()-start
+    return cefpython
+
+
+class LazyCefPython(object):
+    """
+    Stands in for the cefpython module and imports it on first attribute
+    access. Afterwards the module's attributes are copied onto the instance,
+    so later lookups don't go through __getattr__ anymore.
+    """
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        module = load_cefpython()
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+cefpython = LazyCefPython()
+
+
+class CefRuntime(object):
+    # Interval in which the visibility of all browsers gets checked
+    visibility_interval = 0.5
+
+    def __init__(self, cefpython=cefpython):
+        self.cefpython = cefpython
+        self.initialized = False
+        self.browsers = []
+        self.cookie_stores = {}
+        self.pump = MessagePump(cefpython)
+
+    def initialize(self, switches=None, resources_dir="", pump_min_interval=None, pump_max_interval=None):
+        """
+        Initializes CEF, only the first call has an effect. Switches and the
+        cookie location of later calls are ignored, the message pump
+        intervals (see MessagePump, shared by all browsers) get applied by
+        every call passing them.
+        """
+        self.pump.set_intervals(pump_min_interval, pump_max_interval)
+        if self.initialized:
+            return
+        load_cefpython()
+        start = time.time()
+        cefpython = self.cefpython
+        md = cefpython.GetModuleDirectory()
+        settings = {
+                    #"debug": True,
+                    "log_severity": cefpython.LOGSEVERITY_INFO,
+                    #"log_file": "debug.log",
+                    "persist_session_cookies": True,
+                    "release_dcheck_enabled": True,  # Enable only when debugging.
+                    "locales_dir_path": os.path.join(md, "locales"),
+                    "browser_subprocess_path": "%s/%s" % (md, "subprocess")
+                }
+        cefpython.Initialize(settings, switches or {})
+        self.initialized = True
+        timings["initialize"] = time.time()-start
+
+        cefpython.SetGlobalClientCallback("OnCertificateError", self.on_certificate_error)
+
+        # Set cookie manager
+        cookie_path = os.path.join(resources_dir or md, "cookies")
+        self.cookie_store().manager.SetStoragePath(cookie_path, True)
+
+    def cookie_store(self, path=None):
+        """
+        Returns the CookieStore of path (None for the global one), stores are
+        created once and shared by all browsers using the same path.
+        """
+        store = self.cookie_stores.get(path)
+        if store is None:
+            store = self.cookie_stores[path] = CookieStore(self.cefpython, path)
+        return store
+
+    def warm_up(self, switches=None, resources_dir="", delay=0, **pump_intervals):
+        """
+        Loads and initializes CEF after delay seconds (on the main thread, as
+        CEF requires), e.g. right after the first frame of the app got drawn,
+        so the first browser doesn't have to wait for it.
+        """
+        def warm_up(*largs):
+            self.initialize(switches, resources_dir, **pump_intervals)
+        Clock.schedule_once(warm_up, delay)
+
+    def record_timing(self, name, duration):
+        """
+        Records a startup step, only the first occurrence is kept.
+        """
+        timings.setdefault(name, duration)
+
+    def startup_timings(self):
+        """
+        Returns the duration in seconds of the startup steps seen so far:
+        cefpython_import, initialize, create_browser (CreateBrowserSync of the
+        first browser) and first_paint (creation of the first browser to its
+        first paint).
+        """
+        return dict(timings)
+
+    def register(self, browser_widget):
+        if browser_widget in self.browsers:
+            return
+        self.browsers.append(browser_widget)
+        if len(self.browsers) == 1:
+            self.pump.start()
+            Clock.schedule_interval(self.update_visibility, self.visibility_interval)
+
+    def unregister(self, browser_widget):
+        if browser_widget not in self.browsers:
+            return
+        self.browsers.remove(browser_widget)
+        self.pump.set_busy(browser_widget, False)
+        if not self.browsers:
+            Clock.unschedule(self.update_visibility)
+            # Keep pumping a little, so CEF can finish closing the browser
+            Clock.schedule_once(self._stop_pump, 1)
+
+    def _stop_pump(self, *largs):
+        if not self.browsers:
+            self.pump.stop()
+
+    def update_visibility(self, *largs):
+        # Removing an ancestor from the widget tree doesn't dispatch anything
+        # on the browser widget, so the visibility is checked periodically.
+        for browser_widget in self.browsers:
+            browser_widget.update_visibility()
+
+    def on_certificate_error(self, err, url, cb):
+        # The callback isn't tied to a browser, the newest one handles it
+        if self.browsers:
+            self.browsers[-1].OnCertificateError(err, url, cb)
+        else:
+            cb.Continue(False)
+
+    def shutdown(self):
+        for browser_widget in self.browsers[:]:
+            browser_widget.close()
+        self.pump.stop()
+        Clock.unschedule(self.update_visibility)
+        if self.initialized:
+            self.cefpython.Shutdown()
+            self.initialized = False
@@ -0,0 +1,180 @@
+"""
+Snapshots.
+Small previews of a browser (tab switchers, recent pages) are downscaled
+from the latest frame CEF painted, the copy kept by the FrameStage. A worker
+thread copies the rows it needs out of it (holding the stage's lock, paints
+wait for that) and downscales them, the main thread does nothing but
+create the texture. Snapshots are cached per size until CEF paints again, so
+asking for the preview of a page that didn't change is free.
+NumPy is optional: with it the frame gets box filtered (every source pixel
+counts), without it a plain nearest neighbour downscale is done. It's only
+imported with the first snapshot, importing cefkivy stays cheap.
+"""
+import threading
+from functools import partial
+
+from kivy.clock import Clock
+from kivy.graphics.texture import Texture
+
+_numpy = False  # Not imported yet
+
+
+def load_numpy():
+    """
+    Imports NumPy (once) and returns the module, None if not installed.
+    """
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+
+def source_rows(height, target_height):
+    """
+    Returns the rows of the frame the downscale reads, top row first.
+    """
+    if load_numpy() is not None:
+        count = target_height*max(1, height//target_height)
+    else:
+        count = target_height
+    return [i*height//count for i in range(count)]
+
+
+def downscale(rows, width, target_width, target_height):
+    """
+    Downscales the BGRA rows of a frame (bytes, the rows source_rows()
+    returned) and returns the BGRA bytes of the snapshot.
+    """
+    if load_numpy() is not None:
+        return downscale_numpy(rows, width, target_width, target_height).tobytes()
+    row = width*4
+    out = bytearray(target_width*target_height*4)
+    columns = [(x*width//target_width)*4 for x in range(target_width)]
+    i = 0
+    for y in range(target_height):
+        offset = y*row
+        for column in columns:
+            out[i:i+4] = rows[offset+column:offset+column+4]
+            i += 4
+    return bytes(out)
+
+
+def downscale_numpy(rows, width, target_width, target_height):
+    """
+    Box filter: the rows (a multiple of target_height) get resampled to a
+    multiple of the target width and each block of pixels is averaged.
+    Returns a (target_height, target_width, 4) uint8 array.
+    """
+    numpy = load_numpy()
+    pixels = numpy.frombuffer(rows, dtype=numpy.uint8).reshape(-1, width, 4)
+    factor_y = pixels.shape[0]//target_height
+    factor_x = max(1, width//target_width)
+    columns = numpy.arange(target_width*factor_x)*width//(target_width*factor_x)
+    pixels = pixels[:, columns]
+    blocks = pixels.reshape(target_height, factor_y, target_width, factor_x, 4)
+    # Block sums of 8 bit values need a wider type
+    summed = blocks.sum(axis=(1, 3), dtype=numpy.uint32)
+    return (summed//(factor_y*factor_x)).astype(numpy.uint8)
+
+
+class Snapshots(object):
+
+    def __init__(self, browser_widget):
+        self.browser_widget = browser_widget
+        self.cache = {}  # (width, height, as_texture) -> (paint counter, snapshot)
+        self.pending = {}  # (width, height, as_texture) -> callbacks
+        # Counters
+        self.hits = 0
+        self.misses = 0
+
+    def snapshot(self, size, callback, as_texture=True):
+        """
+        Calls callback on the Kivy thread with a snapshot of the page,
+        downscaled to size: a Texture, or if as_texture is False an RGBA
+        NumPy array (height, width, 4, top row first) or, without NumPy,
+        the RGBA bytes. None if nothing got painted yet or the snapshot
+        failed.
+        """
+        stage = self.browser_widget.frame_stage
+        key = (max(1, int(size[0])), max(1, int(size[1])), as_texture)
+        cached = self.cache.get(key)
+        # A released frame (see CefBrowser.release_frame) keeps its snapshots
+        if cached and (cached[0] == stage.painted or not stage.width):
+            self.hits += 1
+            Clock.schedule_once(lambda dt: callback(cached[1]))
+            return
+        if not stage.width:
+            Clock.schedule_once(lambda dt: callback(None))
+            return
+        if key in self.pending:
+            self.pending[key].append(callback)
+            return
+        self.misses += 1
+        self.pending[key] = [callback]
+        thread = threading.Thread(target=self._downscale, name="cefkivy-snapshot", args=(key, stage))
+        thread.daemon = True
+        thread.start()
+
+    def _read_rows(self, stage, key):
+        """
+        Copies the rows the downscale needs out of the frame copy, the main
+        thread keeps painting into it. Returns (paint counter, rows, width,
+        target width, target height), rows is None if there is no frame.
+        """
+        with stage.lock:
+            width, height, painted = stage.width, stage.height, stage.painted
+            if not width:
+                return painted, None, 0, 0, 0
+            target_width = min(key[0], width)
+            target_height = min(key[1], height)
+            rows = source_rows(height, target_height)
+            frame = stage.frame.view(width*height*4)
+            row = width*4
+            if len(rows) == height:
+                data = frame.tobytes()
+            else:
+                data = b"".join(frame[y*row:(y+1)*row].tobytes() for y in rows)
+        return painted, data, width, target_width, target_height
+
+    def _downscale(self, key, stage):
+        painted = None
+        try:
+            painted, rows, width, target_width, target_height = self._read_rows(stage, key)
+            data = rows and self._convert(key[2], rows, width, target_width, target_height)
+        except Exception as e:
+            print("Snapshot failed: %s" % e)
+            data = target_width = target_height = None
+        Clock.schedule_once(partial(self._done, key, data, target_width, target_height, painted))
+
+    def _convert(self, as_texture, rows, width, target_width, target_height):
+        if as_texture:
+            return downscale(rows, width, target_width, target_height)
+        if load_numpy() is not None:
+            data = downscale_numpy(rows, width, target_width, target_height)
+            # BGRA to RGBA
+            return data[..., [2, 1, 0, 3]]
+        data = bytearray(downscale(rows, width, target_width, target_height))
+        data[0::4], data[2::4] = data[2::4], data[0::4]
+        return bytes(data)
+
+    def _done(self, key, data, width, height, painted, *largs):
+        if data is None:
+            for callback in self.pending.pop(key, []):
+                callback(None)
+            return
+        if key[2]:
+            # Textures can only be created on the main thread
+            texture = Texture.create(size=(width, height), colorfmt='rgba', bufferfmt='ubyte')
+            texture.blit_buffer(data, colorfmt='bgra', bufferfmt='ubyte')
+            texture.flip_vertical()
+            data = texture
+        self.cache[key] = (painted, data)
+        for callback in self.pending.pop(key, []):
+            callback(data)
+
+    def clear(self):
+        self.cache.clear()
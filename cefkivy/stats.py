@@ -0,0 +1,136 @@
+"""
+Render pipeline statistics.
+Counters are kept in one second slots over a rolling window and durations in
+fixed bucket histograms, so recording a value is a couple of additions and
+the stats can stay enabled in production.
+"""
+import time
+from bisect import bisect_left
+from collections import deque
+
+
+class RollingCounter(object):
+    """
+    Sum of values over the last window seconds.
+    """
+
+    def __init__(self, window=10):
+        self.window = window
+        self.slots = deque()
+        self.total = 0  # Since creation
+
+    def add(self, value=1):
+        second = int(time.time())
+        if self.slots and self.slots[-1][0] == second:
+            self.slots[-1][1] += value
+        else:
+            self.slots.append([second, value])
+            while self.slots[0][0] <= second-self.window:
+                self.slots.popleft()
+        self.total += value
+
+    def sum(self):
+        oldest = int(time.time())-self.window
+        return sum(value for second, value in self.slots if second > oldest)
+
+    def rate(self):
+        """
+        Average per second over the window.
+        """
+        return self.sum()/float(self.window)
+
+
+class RollingHistogram(object):
+    """
+    Histogram of durations (seconds) over the last one to two windows. The
+    buckets grow exponentially from 50us to about 1.6s, percentiles are
+    reported as the upper bound of the bucket they fall into.
+    """
+    bounds = [0.00005*2**i for i in range(16)]
+
+    def __init__(self, window=10):
+        self.window = window
+        self.current = [0]*(len(self.bounds)+1)
+        self.previous = [0]*(len(self.bounds)+1)
+        self.rotated = time.time()
+        self.max = 0
+
+    def _rotate(self):
+        now = time.time()
+        if now-self.rotated < self.window:
+            return
+        if now-self.rotated < 2*self.window:
+            self.previous = self.current
+        else:
+            self.previous = [0]*(len(self.bounds)+1)
+        self.current = [0]*(len(self.bounds)+1)
+        self.rotated = now
+        self.max = 0
+
+    def add(self, value):
+        self._rotate()
+        self.current[bisect_left(self.bounds, value)] += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        self._rotate()
+        counts = [a+b for a, b in zip(self.current, self.previous)]
+        count = sum(counts)
+        if not count:
+            return 0
+        rank = p/100.*count
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self, prefix):
+        return {prefix+"_p50": self.percentile(50),
+                prefix+"_p95": self.percentile(95),
+                prefix+"_p99": self.percentile(99),
+                prefix+"_max": self.max,
+                }
+
+
+class RenderStats(object):
+    """
+    Statistics of one browser widget, see CefBrowser.stats.
+    """
+
+    def __init__(self, window=10):
+        self.window = window
+        self.paints = RollingCounter(window)
+        self.bytes_copied = RollingCounter(window)
+        self.bytes_uploaded = RollingCounter(window)
+        self.uploads = RollingCounter(window)
+        self.input_events = RollingCounter(window)
+        self.input_sent = RollingCounter(window)  # After coalescing
+        self.upload_time = RollingHistogram(window)
+
+    def snapshot(self, frame_counters=None, pump=None):
+        """
+        Returns the current statistics as flat dict.
+        """
+        stats = {"paints_per_second": self.paints.rate(),
+                 "uploads_per_second": self.uploads.rate(),
+                 "bytes_copied_per_second": self.bytes_copied.rate(),
+                 "bytes_uploaded_per_second": self.bytes_uploaded.rate(),
+                 "input_events_per_second": self.input_events.rate(),
+                 "input_sent_per_second": self.input_sent.rate(),
+                 "bytes_copied": self.bytes_copied.total,
+                 "bytes_uploaded": self.bytes_uploaded.total,
+                 "input_events": self.input_events.total,
+                 "input_sent": self.input_sent.total,
+                 }
+        stats.update(self.upload_time.summary("upload_time"))
+        if frame_counters:
+            for element, counters in frame_counters.items():
+                for name, value in counters.items():
+                    stats["%s_%s" % (element, name)] = value
+        if pump:
+            stats.update(pump.work_times.summary("pump_work_time"))
+            stats["pump_ticks_per_second"] = pump.stats()["ticks_per_second"]
+        return stats
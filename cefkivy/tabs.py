@@ -0,0 +1,207 @@
+"""
+Tabbed browser.
+Only the browser of the current tab is in the widget tree, so only it gets
+input and renders: the background tabs are hidden for CEF (see
+CefBrowser.auto_hide), run at background_fps and give their frame copy and
+texture back. All tabs share one staging buffer and texture pool, so a tab in
+the background costs its renderer process only.
+Tabs idle in the background for longer than discard_after get their browser
+closed. Their URL and history are kept and the browser gets created again
+when the tab is selected.
+"""
+import time
+
+from kivy.clock import Clock
+from kivy.properties import NumericProperty, ObjectProperty, ListProperty
+from kivy.uix.boxlayout import BoxLayout
+
+from browser import CefBrowser
+from paint import StagingBuffer, TexturePool
+
+
+class Tab(object):
+
+    def __init__(self, url):
+        self.url = url
+        self.title = ""
+        # Own history, CEF's is lost when a discarded tab gets restored
+        self.history = [url]
+        self.index = 0
+        self.can_go_back = False
+        self.can_go_forward = False
+        self.browser = None
+        self.last_active = time.time()
+
+    @property
+    def discarded(self):
+        return self.browser is None
+
+    def record_address(self, url):
+        """
+        Keeps the history in sync with the addresses the browser shows.
+        """
+        if url == self.history[self.index]:
+            return
+        if self.index > 0 and url == self.history[self.index-1]:
+            self.index -= 1
+        elif self.index+1 < len(self.history) and url == self.history[self.index+1]:
+            self.index += 1
+        else:
+            del self.history[self.index+1:]
+            self.history.append(url)
+            self.index += 1
+        self.url = url
+
+
+class CefTabs(BoxLayout):
+    tabs = ListProperty([])
+    current_tab = ObjectProperty(None, allownone=True)
+    # Frame rate of the background tabs
+    background_fps = NumericProperty(1)
+    # Seconds a background tab may be idle before its browser gets closed,
+    # 0 to never discard tabs
+    discard_after = NumericProperty(300)
+    discard_check_interval = 10
+
+    def __init__(self, **browser_kwargs):
+        """
+        :param browser_kwargs: Passed to every CefBrowser
+        """
+        super(CefTabs, self).__init__()
+        self.browser_kwargs = browser_kwargs
+        self.foreground_fps = browser_kwargs.get("max_fps", 0)
+        self.staging = StagingBuffer()
+        self.texture_pool = TexturePool()
+        Clock.schedule_interval(self.discard_idle, self.discard_check_interval)
+
+    def open(self, url, select=True):
+        """
+        Opens url in a new tab, returns the Tab.
+        """
+        tab = Tab(url)
+        self.tabs.append(tab)
+        if select:
+            self.select(tab)
+        else:
+            tab.browser = self._create_browser(tab)
+            self._to_background(tab)
+        return tab
+
+    def close_tab(self, tab):
+        index = self.tabs.index(tab)
+        self.tabs.remove(tab)
+        if tab.browser:
+            self.remove_widget(tab.browser)
+            tab.browser.close()
+            tab.browser = None
+        if tab is self.current_tab:
+            self.current_tab = None
+            if self.tabs:
+                self.select(self.tabs[min(index, len(self.tabs)-1)])
+
+    def select(self, tab):
+        current = self.current_tab
+        if current is tab:
+            return
+        if current and current.browser:
+            self.remove_widget(current.browser)
+            self._to_background(current)
+        if tab.browser is None:
+            # Discarded or never shown, restores the current history entry
+            tab.browser = self._create_browser(tab)
+        tab.browser.max_fps = self.foreground_fps
+        tab.last_active = time.time()
+        self.current_tab = tab
+        self.add_widget(tab.browser)
+
+    def _to_background(self, tab):
+        browser = tab.browser
+        browser.release_keyboard()
+        browser.input_queue.clear()
+        browser.max_fps = self.background_fps
+        # Hidden right away (not with the next visibility check), so paints
+        # arriving until CEF stops painting don't take a texture again
+        browser.update_visibility()
+        browser.release_frame()
+        tab.last_active = time.time()
+
+    def _create_browser(self, tab):
+        kwargs = dict(self.browser_kwargs)
+        kwargs.update(url=tab.history[tab.index], staging=self.staging, texture_pool=self.texture_pool)
+        browser = CefBrowser(**kwargs)
+        browser.size = self.size
+
+        def on_address_change(instance, frame, url):
+            if frame.IsMain():
+                tab.record_address(url)
+
+        def on_title_change(instance, title):
+            tab.title = title
+
+        def on_loading_state_change(instance, is_loading, can_go_back, can_go_forward):
+            tab.can_go_back = can_go_back
+            tab.can_go_forward = can_go_forward
+
+        browser.bind(on_address_change=on_address_change, on_title_change=on_title_change,
+                     on_loading_state_change=on_loading_state_change)
+        return browser
+
+    def discard(self, tab):
+        """
+        Closes the browser of a background tab, it gets restored from the
+        tab's history when selected.
+        """
+        if tab is self.current_tab or tab.browser is None:
+            return
+        tab.browser.close()
+        tab.browser = None
+        tab.can_go_back = tab.can_go_forward = False
+
+    def discard_idle(self, *largs):
+        if not self.discard_after:
+            return
+        now = time.time()
+        for tab in self.tabs:
+            if tab is not self.current_tab and now-tab.last_active > self.discard_after:
+                self.discard(tab)
+
+    def go_back(self):
+        tab = self.current_tab
+        if not tab:
+            return
+        if tab.can_go_back:
+            tab.browser.go_back()
+        elif tab.index > 0:
+            # History from before the tab got restored
+            self._navigate(tab.browser, tab.history[tab.index-1])
+
+    def go_forward(self):
+        tab = self.current_tab
+        if not tab:
+            return
+        if tab.can_go_forward:
+            tab.browser.go_forward()
+        elif tab.index+1 < len(tab.history):
+            self._navigate(tab.browser, tab.history[tab.index+1])
+
+    def _navigate(self, browser, url):
+        if browser.url == url:
+            # The url property is outdated after link clicks
+            browser.property("url").dispatch(browser)
+        else:
+            browser.url = url
+
+    def close(self):
+        Clock.unschedule(self.discard_idle)
+        for tab in self.tabs[:]:
+            if tab.browser:
+                tab.browser.close()
+                tab.browser = None
+        self.tabs = []
+        self.current_tab = None
+
+    def stats(self):
+        return {"tabs": len(self.tabs),
+                "alive": sum(1 for tab in self.tabs if tab.browser),
+                "textures_created": self.texture_pool.created,
+                }
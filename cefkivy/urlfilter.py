@@ -0,0 +1,203 @@
+"""
+Request filter.
+Blocks requests (trackers, analytics, ad frames, ...) in OnBeforeBrowse and
+OnBeforeResourceLoad by rules, one per line:
+
+    # Comment
+    block tracker.example.com
+    block example.com/ads/ image,sub_frame
+    allow example.com/ads/logo.png
+    block *  media
+
+A rule is allow or block, a domain (matching its subdomains as well, "*"
+matches all), an optional path prefix and optional resource types (see
+RESOURCE_TYPES), comma separated. Allow rules win over block rules.
+The domains are compiled into a trie of reversed labels, so a check walks
+the labels of one host name no matter how many rules there are.
+"""
+import os
+
+from kivy.clock import Clock
+
+# Resource type names, from the cefpython RT_* constants
+RESOURCE_TYPES = ("main_frame", "sub_frame", "stylesheet", "script", "image",
+                  "font_resource", "sub_resource", "object", "media", "worker",
+                  "shared_worker", "prefetch", "favicon", "xhr")
+
+
+class Rule(object):
+
+    def __init__(self, line, allow, domain, path, types):
+        self.line = line
+        self.allow = allow
+        self.domain = domain
+        self.path = path
+        self.types = types  # frozenset or None for all
+        self.hits = 0
+
+    def matches(self, path, resource_type):
+        if self.path and not path.startswith(self.path):
+            return False
+        if self.types is not None and resource_type not in self.types:
+            return False
+        return True
+
+
+def parse_rule(line):
+    """
+    Returns a Rule, None for empty lines and comments.
+    """
+    line = line.split("#", 1)[0].strip()
+    if not line:
+        return None
+    parts = line.split()
+    if parts[0] not in ("allow", "block") or len(parts) not in (2, 3):
+        raise ValueError("Invalid rule: %s" % line)
+    pattern = parts[1]
+    if "://" in pattern:
+        pattern = pattern.split("://", 1)[1]
+    domain, slash, path = pattern.partition("/")
+    types = None
+    if len(parts) == 3:
+        types = frozenset(parts[2].split(","))
+        unknown = types.difference(RESOURCE_TYPES)
+        if unknown:
+            raise ValueError("Unknown resource type %s in rule: %s" % (", ".join(sorted(unknown)), line))
+    return Rule(line, parts[0] == "allow", domain.lower(), slash+path if slash else "", types)
+
+
+def split_url(url):
+    """
+    Returns (host, path) of url, host is None for URLs without one (about:,
+    data:, ...).
+    """
+    scheme, sep, rest = url.partition("://")
+    if not sep:
+        return None, ""
+    hostport, slash, path = rest.partition("/")
+    host = hostport.rpartition("@")[2].split(":", 1)[0].lower()
+    return host, slash+path
+
+
+class RuleSet(object):
+    """
+    Compiled rules. Trie nodes are dicts of label -> node, the rules of a
+    domain are stored in the node under the key None.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.trie = {}
+        for rule in rules:
+            node = self.trie
+            if rule.domain != "*":
+                for label in reversed(rule.domain.split(".")):
+                    node = node.setdefault(label, {})
+            node.setdefault(None, []).append(rule)
+
+    def match(self, host, path, resource_type):
+        """
+        Returns the deciding rule or None if no rule matches.
+        """
+        node = self.trie
+        blocked = None
+        candidates = node.get(None)
+        labels = host.split(".")
+        i = len(labels)
+        while True:
+            if candidates:
+                for rule in candidates:
+                    if rule.matches(path, resource_type):
+                        if rule.allow:
+                            return rule
+                        if blocked is None:
+                            blocked = rule
+            i -= 1
+            if i < 0:
+                break
+            node = node.get(labels[i])
+            if node is None:
+                break
+            candidates = node.get(None)
+        return blocked
+
+
+class RequestFilter(object):
+
+    def __init__(self, rules=None, path=None):
+        """
+        :param rules: Rule lines
+        :param path: Rule file, loaded now and by reload()
+        """
+        self.path = path
+        self.ruleset = RuleSet([])
+        self._mtime = None
+        # Counters
+        self.checked = 0
+        self.blocked = 0
+        if path:
+            self.reload()
+        elif rules:
+            self.set_rules(rules)
+
+    def set_rules(self, lines):
+        """
+        Compiles the rules and swaps them in. Hit counters of unchanged rules
+        are kept.
+        """
+        hits = dict((rule.line, rule.hits) for rule in self.ruleset.rules)
+        rules = []
+        for line in lines:
+            rule = parse_rule(line)
+            if rule:
+                rule.hits = hits.get(rule.line, 0)
+                rules.append(rule)
+        # A single assignment, checks on the IO thread see the old or the new set
+        self.ruleset = RuleSet(rules)
+
+    def reload(self, *largs):
+        """
+        Loads the rule file again if it changed. A broken file keeps the
+        current rules.
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return False
+            with open(self.path) as f:
+                self.set_rules(f.readlines())
+        except (IOError, OSError, ValueError) as e:
+            print("Can't load request filter rules: %s" % e)
+            return False
+        self._mtime = mtime
+        return True
+
+    def watch(self, interval=2):
+        """
+        Checks the rule file for changes every interval seconds.
+        """
+        Clock.unschedule(self.reload)
+        Clock.schedule_interval(self.reload, interval)
+
+    def unwatch(self):
+        Clock.unschedule(self.reload)
+
+    def is_blocked(self, url, resource_type=None):
+        self.checked += 1
+        host, path = split_url(url)
+        if host is None:
+            return False
+        rule = self.ruleset.match(host, path, resource_type)
+        if rule is None:
+            return False
+        rule.hits += 1
+        if rule.allow:
+            return False
+        self.blocked += 1
+        return True
+
+    def stats(self):
+        return {"checked": self.checked,
+                "blocked": self.blocked,
+                "rules": dict((rule.line, rule.hits) for rule in self.ruleset.rules),
+                }